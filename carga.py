@@ -0,0 +1,418 @@
+"""
+Teste de carga e soak do fluxo do app contra uma API RD Station simulada.
+
+Cada sessão simulada faz o que um operador faz no main.py — busca pipelines,
+lista deals, baixa os holerites (mesmas camadas rede/download/dedup), monta o
+ZIP e grava os arquivos compartilhados (tokens e processados) com o mesmo
+padrão de escrita do app. As sessões rodam em threads, como as sessões do
+Streamlit num mesmo processo.
+
+    python carga.py                                  # curva 1, 2, 5, 10, 20 sessões
+    python carga.py --sessoes 1 5 20 40 --deals 200 --latencia-ms 30
+    python carga.py --sessoes 20 --soak 600          # soak: 20 sessões por 10 min
+    python carga.py --limite-api 10 --json resultado.json
+
+Mede por nível de concorrência: vazão (sessões/s e PDFs/s), latência por
+sessão (p50/p95/p99), taxa de requisições à API, memória por sessão e total,
+e contenção em rd_tokens.json / processed_leads.json (latência de escrita,
+leituras corrompidas durante escritas concorrentes e atualizações perdidas).
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import download
+from deduplicacao import chave_arquivo, resolver_duplicado
+from download import baixar_conteudo, percentil
+from holerites import MESES_MAP, eh_holerite, arquivo_dentro_periodo, filtrar_deals
+from rede import requisitar
+
+NIVEIS_PADRAO = [1, 2, 5, 10, 20]
+
+
+# ── API simulada ─────────────────────────────────────────────
+
+class ApiSimulada:
+    """RD Station CRM falso: pipelines, deals paginados, arquivos dos deals e os PDFs."""
+
+    def __init__(self, n_deals=100, arquivos_por_deal=3, tamanho_pdf=150 * 1024,
+                 latencia_ms=20, limite_req_s=None, semente=42):
+        self.n_deals = n_deals
+        self.arquivos_por_deal = arquivos_por_deal
+        self.latencia = latencia_ms / 1000
+        self.limite_req_s = limite_req_s
+        self._lock = threading.Lock()
+        self.requisicoes = []          # (instante, endpoint, status)
+        rnd = random.Random(semente)
+        ano = time.localtime().tm_year
+        self.deals = [{
+            'id': f"deal{i:05d}",
+            'name': f"Cliente {i}",
+            'pipeline_id': "pipe1",
+            'stage_id': f"stage{i % 3}",
+            'organization_id': f"org{i % 7}",
+            'created_at': f"{ano}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}T10:00:00Z",
+        } for i in range(n_deals)]
+        # Conteúdos: alguns PDFs repetidos entre deals (exercita a deduplicação)
+        self.pdfs = [b"%PDF-1.4\n" + rnd.randbytes(tamanho_pdf) for _ in range(max(1, n_deals // 2))]
+        self.servidor = None
+
+    @property
+    def base(self):
+        host, porta = self.servidor.server_address
+        return f"http://{host}:{porta}"
+
+    def _registrar(self, endpoint, status):
+        with self._lock:
+            self.requisicoes.append((time.monotonic(), endpoint, status))
+
+    def _limitado(self):
+        if not self.limite_req_s:
+            return False
+        agora = time.monotonic()
+        with self._lock:
+            recentes = sum(1 for t, _, s in self.requisicoes[-(int(self.limite_req_s) * 2 + 1):]
+                           if agora - t < 1 and s != 429)
+        return recentes >= self.limite_req_s
+
+    def arquivos_do_deal(self, deal_idx):
+        nomes = ["holerite {mes}.pdf", "contracheque_{mes}.pdf", "rg.pdf", "extrato.pdf"]
+        deal = self.deals[deal_idx]
+        mes = int(deal['created_at'][5:7])
+        return [{
+            'id': f"{deal['id']}_f{j}",
+            'name': nomes[j % len(nomes)].format(mes=MESES_MAP[mes][0]),
+            'created_at': deal['created_at'],
+            'url': f"{self.base}/files/{(deal_idx + j) % len(self.pdfs)}.pdf",
+        } for j in range(self.arquivos_por_deal)]
+
+    def iniciar(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, fmt, *args):
+                pass
+
+            def _json(self, status, corpo, endpoint):
+                dados = json.dumps(corpo).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(dados)))
+                self.end_headers()
+                self.wfile.write(dados)
+                api._registrar(endpoint, status)
+
+            def _responder(self):
+                url = urlparse(self.path)
+                partes = url.path.strip('/').split('/')
+                time.sleep(api.latencia)
+                if api._limitado():
+                    self.send_response(429)
+                    self.send_header('Retry-After', '1')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    api._registrar(partes[0], 429)
+                    return
+                if partes == ['oauth2', 'token']:
+                    tamanho = int(self.headers.get('Content-Length') or 0)
+                    self.rfile.read(tamanho)
+                    return self._json(200, {'access_token': 'tok', 'refresh_token': 'ref', 'expires_in': 86400}, 'token')
+                if partes[:2] == ['crm', 'v2'] and partes[2:] == ['pipelines']:
+                    return self._json(200, {'data': [{'id': 'pipe1', 'name': 'Folha'}]}, 'pipelines')
+                if partes[:2] == ['crm', 'v2'] and partes[2:] == ['deals']:
+                    q = parse_qs(url.query)
+                    pagina = int(q.get('page[number]', ['1'])[0])
+                    tamanho = int(q.get('page[size]', ['100'])[0])
+                    fatia = api.deals[(pagina - 1) * tamanho:pagina * tamanho]
+                    links = {'next': f"?page[number]={pagina + 1}"} if pagina * tamanho < len(api.deals) else {}
+                    return self._json(200, {'data': fatia, 'links': links}, 'deals')
+                if partes[:3] == ['crm', 'v2', 'deals'] and len(partes) == 5 and partes[4] == 'files':
+                    idx = int(partes[3].replace('deal', ''))
+                    return self._json(200, {'data': api.arquivos_do_deal(idx)}, 'files')
+                if partes[0] == 'files':
+                    corpo = api.pdfs[int(partes[1].split('.')[0])]
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/pdf')
+                    self.send_header('Content-Length', str(len(corpo)))
+                    self.end_headers()
+                    self.wfile.write(corpo)
+                    api._registrar('pdf', 200)
+                    return
+                self._json(404, {'erro': 'não encontrado'}, 'outro')
+
+            do_GET = _responder
+            do_POST = _responder
+
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.servidor.daemon_threads = True
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+        return self
+
+    def parar(self):
+        if self.servidor:
+            self.servidor.shutdown()
+            self.servidor.server_close()
+
+    def taxa(self, desde, ate):
+        """Requisições/s no intervalo e contagem por endpoint/status."""
+        with self._lock:
+            janela = [(e, s) for t, e, s in self.requisicoes if desde <= t <= ate]
+        por_endpoint = {}
+        for e, s in janela:
+            chave = e if s < 400 else f"{e}:{s}"
+            por_endpoint[chave] = por_endpoint.get(chave, 0) + 1
+        return len(janela) / max(ate - desde, 1e-9), por_endpoint
+
+
+# ── Arquivos compartilhados (mesmo padrão de escrita do app) ──
+
+class ArquivosCompartilhados:
+    """rd_tokens.json e processed_leads.json num diretório temporário, com métricas de contenção."""
+
+    def __init__(self, diretorio):
+        self.token_file = os.path.join(diretorio, "rd_tokens.json")
+        self.processed_file = os.path.join(diretorio, "processed_leads.json")
+        self._lock = threading.Lock()
+        self.tempos_escrita = []
+        self.leituras_corrompidas = 0
+        self.esperados = set()
+
+    def _medir(self, inicio):
+        with self._lock:
+            self.tempos_escrita.append(time.perf_counter() - inicio)
+
+    def _leitura_corrompida(self):
+        with self._lock:
+            self.leituras_corrompidas += 1
+
+    def salvar_tokens(self, data):
+        # Escrita atômica, como salvar_tokens do main.py
+        inicio = time.perf_counter()
+        temporario = f"{self.token_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporario, 'w') as f:
+            json.dump({'access_token': data['access_token'], 'refresh_token': data['refresh_token'],
+                       'expires_at': time.strftime('%Y-%m-%dT%H:%M:%S')}, f)
+        os.replace(temporario, self.token_file)
+        self._medir(inicio)
+
+    def carregar_tokens(self):
+        if not os.path.exists(self.token_file):
+            return None
+        try:
+            with open(self.token_file, 'r') as f:
+                return json.load(f)
+        except Exception:
+            self._leitura_corrompida()
+            return None
+
+    def carregar_processados(self):
+        if not os.path.exists(self.processed_file):
+            return set()
+        try:
+            with open(self.processed_file, 'r') as f:
+                return set(json.load(f) or [])
+        except Exception:
+            self._leitura_corrompida()
+            return set()
+
+    def salvar_processados(self, novos):
+        # Ler-modificar-escrever, como o botão "Baixar Holerites"
+        processados = self.carregar_processados() | novos
+        inicio = time.perf_counter()
+        with open(self.processed_file, 'w') as f:
+            json.dump(sorted(processados), f)
+        self._medir(inicio)
+        with self._lock:
+            self.esperados |= novos
+
+    def atualizacoes_perdidas(self):
+        return len(self.esperados - self.carregar_processados())
+
+
+# ── Sessão simulada ──────────────────────────────────────────
+
+def tamanho_sessao(estado):
+    """Bytes mantidos no 'session_state' da sessão (PDFs + ZIP)."""
+    return sum(len(h['conteudo']) for h in estado['holerites_baixados']) + len(estado.get('zip', b''))
+
+
+def executar_sessao(api, compartilhados, sessao_id, max_deals, hedge=False):
+    """Um operador: autentica, busca, baixa, deduplica, monta o ZIP e grava os processados."""
+    inicio = time.perf_counter()
+    estado = {'holerites_baixados': [], 'duplicados': {}}
+
+    # O app lê rd_tokens.json a cada rerun enquanto outras sessões renovam o token
+    compartilhados.carregar_tokens()
+    token = requisitar("POST", f"{api.base}/oauth2/token", classe="auth", data={'grant_type': 'refresh_token'}).json()
+    compartilhados.salvar_tokens(token)
+    headers = {"Authorization": f"Bearer {token['access_token']}"}
+
+    requisitar("GET", f"{api.base}/crm/v2/pipelines", headers=headers)
+
+    # Cada sessão filtra um mês diferente, como operadores diferentes
+    mes = sessao_id % 12 + 1
+    deals, pagina = [], 1
+    while len(deals) < max_deals:
+        dados = requisitar("GET", f"{api.base}/crm/v2/deals", headers=headers,
+                           params={"page[number]": pagina, "page[size]": 100}).json()
+        deals.extend(filtrar_deals(dados.get('data', []), meses=[mes]))
+        if not dados.get('links', {}).get('next'):
+            break
+        pagina += 1
+    deals = deals[:max_deals]
+
+    hashes, novos = {}, set()
+    for deal in deals:
+        compartilhados.carregar_tokens()
+        arquivos = requisitar("GET", f"{api.base}/crm/v2/deals/{deal['id']}/files", headers=headers).json()['data']
+        for arquivo in arquivos:
+            if not eh_holerite(arquivo['name']) or not arquivo_dentro_periodo(arquivo, [mes], []):
+                continue
+            conteudo, info = baixar_conteudo(arquivo['url'], hedge=hedge)
+            chave = chave_arquivo(deal['id'], arquivo['name'])
+            canonico = resolver_duplicado(info['sha256'], chave, hashes, {}, entre_execucoes=False)
+            if canonico:
+                estado['duplicados'][chave] = canonico
+                continue
+            hashes[info['sha256']] = chave
+            estado['holerites_baixados'].append({'nome': arquivo['name'], 'deal_id': deal['id'],
+                                                 'conteudo': conteudo, 'tamanho': len(conteudo)})
+            novos.add(deal['id'])
+
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for h in estado['holerites_baixados']:
+            zip_file.writestr(chave_arquivo(h['deal_id'], h['nome']), h['conteudo'])
+    estado['zip'] = zip_buffer.getvalue()
+
+    if novos:
+        compartilhados.salvar_processados(novos)
+
+    return {
+        'latencia': time.perf_counter() - inicio,
+        'pdfs': len(estado['holerites_baixados']),
+        'duplicados': len(estado['duplicados']),
+        'bytes_sessao': tamanho_sessao(estado),
+    }
+
+
+# ── Execução ─────────────────────────────────────────────────
+
+def medir_nivel(api, n_sessoes, max_deals, soak=0, hedge=False):
+    """Roda `n_sessoes` simultâneas (em loop por `soak` segundos, se > 0) e devolve as métricas."""
+    with tempfile.TemporaryDirectory() as diretorio:
+        compartilhados = ArquivosCompartilhados(diretorio)
+        resultados, erros = [], []
+        lock = threading.Lock()
+        limite = time.monotonic() + soak
+
+        def operador(sessao_id):
+            while True:
+                try:
+                    r = executar_sessao(api, compartilhados, sessao_id, max_deals, hedge)
+                    with lock:
+                        resultados.append(r)
+                except Exception as e:
+                    with lock:
+                        erros.append(str(e))
+                if not soak or time.monotonic() >= limite:
+                    return
+
+        tracemalloc.start()
+        inicio = time.monotonic()
+        with ThreadPoolExecutor(max_workers=n_sessoes) as pool:
+            list(pool.map(operador, range(n_sessoes)))
+        fim = time.monotonic()
+        _, pico_memoria = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        taxa_api, por_endpoint = api.taxa(inicio, fim)
+        latencias = [r['latencia'] for r in resultados]
+        duracao = fim - inicio
+        return {
+            'sessoes': n_sessoes,
+            'execucoes': len(resultados),
+            'erros': len(erros),
+            'exemplo_erro': erros[0] if erros else None,
+            'duracao_s': duracao,
+            'sessoes_por_s': len(resultados) / duracao,
+            'pdfs_por_s': sum(r['pdfs'] for r in resultados) / duracao,
+            'latencia_p50_s': percentil(latencias, 50),
+            'latencia_p95_s': percentil(latencias, 95),
+            'latencia_p99_s': percentil(latencias, 99),
+            'api_req_por_s': taxa_api,
+            'api_por_endpoint': por_endpoint,
+            'memoria_sessao_mb': (sum(r['bytes_sessao'] for r in resultados) / max(1, len(resultados))) / (1024 * 1024),
+            'memoria_pico_mb': pico_memoria / (1024 * 1024),
+            'rss_max_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'escrita_p95_ms': (percentil(compartilhados.tempos_escrita, 95) or 0) * 1000,
+            'leituras_corrompidas': compartilhados.leituras_corrompidas,
+            'atualizacoes_perdidas': compartilhados.atualizacoes_perdidas(),
+        }
+
+
+def imprimir_tabela(linhas):
+    colunas = [
+        ('sessoes', 'sessões', 7, '{:>7}'), ('execucoes', 'exec', 5, '{:>5}'), ('erros', 'erros', 5, '{:>5}'),
+        ('sessoes_por_s', 'sess/s', 7, '{:>7.2f}'), ('pdfs_por_s', 'pdf/s', 7, '{:>7.1f}'),
+        ('latencia_p50_s', 'p50 s', 6, '{:>6.2f}'), ('latencia_p95_s', 'p95 s', 6, '{:>6.2f}'),
+        ('latencia_p99_s', 'p99 s', 6, '{:>6.2f}'), ('api_req_por_s', 'api/s', 6, '{:>6.1f}'),
+        ('memoria_sessao_mb', 'MB/sess', 7, '{:>7.1f}'), ('memoria_pico_mb', 'pico MB', 7, '{:>7.1f}'),
+        ('escrita_p95_ms', 'escr p95ms', 10, '{:>10.2f}'), ('leituras_corrompidas', 'corromp', 7, '{:>7}'),
+        ('atualizacoes_perdidas', 'perdidas', 8, '{:>8}'),
+    ]
+    print("  ".join(f"{titulo:>{largura}}" for _, titulo, largura, _ in colunas))
+    for linha in linhas:
+        print("  ".join(fmt.format(linha[chave] or 0) for chave, _, _, fmt in colunas))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga/soak do fluxo de holerites contra API simulada")
+    parser.add_argument("--sessoes", nargs="+", type=int, default=NIVEIS_PADRAO, help="níveis de concorrência")
+    parser.add_argument("--deals", type=int, default=120, help="deals na API simulada")
+    parser.add_argument("--max-deals", type=int, default=100, help="MAX_DEALS por sessão")
+    parser.add_argument("--arquivos-por-deal", type=int, default=3)
+    parser.add_argument("--tamanho-pdf-kb", type=int, default=150)
+    parser.add_argument("--latencia-ms", type=int, default=20, help="latência da API simulada")
+    parser.add_argument("--limite-api", type=float, help="req/s antes de responder 429")
+    parser.add_argument("--soak", type=int, default=0, help="segundos de execução contínua por nível")
+    parser.add_argument("--hedge", action="store_true")
+    parser.add_argument("--json", help="grava os resultados neste arquivo")
+    args = parser.parse_args(argv)
+
+    api = ApiSimulada(args.deals, args.arquivos_por_deal, args.tamanho_pdf_kb * 1024,
+                      args.latencia_ms, args.limite_api).iniciar()
+    download.DOWNLOAD_DIR = tempfile.mkdtemp(prefix="carga_downloads_")
+    linhas = []
+    try:
+        for n in args.sessoes:
+            linha = medir_nivel(api, n, args.max_deals, args.soak, args.hedge)
+            linhas.append(linha)
+            if linha['exemplo_erro']:
+                print(f"[{n} sessões] erro: {linha['exemplo_erro']}", file=sys.stderr)
+    finally:
+        api.parar()
+
+    imprimir_tabela(linhas)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(linhas, f, indent=1, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
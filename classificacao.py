@@ -0,0 +1,279 @@
+"""
+Classificação de PDFs pelo conteúdo: lê o texto da primeira página, procura
+marcadores de holerite e a competência (mês/ano). Roda num pool de processos
+e guarda o resultado por sha256 em SQLite, então nenhum arquivo é lido duas vezes.
+
+Depende de `pypdf` (opcional). Sem ele, `disponivel()` retorna False.
+
+    python classificacao.py benchmark pasta_com_pdfs/
+"""
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+from holerites import MESES_MAP, eh_holerite, arquivo_dentro_periodo
+
+CLASSIFICACAO_DB = "classificacao_cache.db"
+# Entradas mantidas no cache; as usadas há mais tempo saem primeiro
+CACHE_MAX_ENTRADAS = 50000
+
+# Marcadores (sem acento, minúsculos) — precisa de pelo menos MIN_MARCADORES
+MARCADORES_HOLERITE = [
+    "holerite", "contracheque", "contra cheque", "recibo de pagamento", "demonstrativo de pagamento",
+    "folha de pagamento", "salario base", "total de vencimentos", "total de descontos",
+    "liquido a receber", "valor liquido", "base calc. fgts", "base inss", "fgts do mes", "competencia",
+]
+MARCADORES_NEGATIVOS = ["extrato", "saldo anterior", "saldo disponivel", "lancamentos"]
+MIN_MARCADORES = 2
+
+# Data numérica só vale depois de um rótulo — um MM/AAAA solto costuma ser admissão, nascimento etc.
+_RE_COMPETENCIA_NUM = re.compile(r"(?:competencia|referencia|mes/ano|periodo)\D{0,15}(\d{1,2})\s*[/.-]\s*(\d{4})")
+_NOMES_MESES = {v: m for m, variantes in MESES_MAP.items() for v in variantes}
+_RE_MES_ANO_NOME = re.compile(
+    r"\b(" + "|".join(sorted(map(re.escape, _NOMES_MESES), key=len, reverse=True)) + r")\s*(?:/|de|-)?\s*(20\d{2})\b"
+)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def disponivel() -> bool:
+    return PdfReader is not None
+
+
+def _normalizar(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def extrair_competencia(texto_norm: str):
+    """(mes, ano) da competência no texto normalizado, ou (None, None)."""
+    for regex in (_RE_COMPETENCIA_NUM, _RE_MES_ANO_NOME):
+        m = regex.search(texto_norm)
+        if m:
+            mes = _NOMES_MESES.get(m.group(1)) or int(m.group(1))
+            if 1 <= mes <= 12:
+                return mes, int(m.group(2))
+    return None, None
+
+
+def classificar_texto(texto: str) -> dict:
+    texto_norm = _normalizar(texto)
+    marcadores = [m for m in MARCADORES_HOLERITE if m in texto_norm]
+    negativos = [m for m in MARCADORES_NEGATIVOS if m in texto_norm]
+    mes, ano = extrair_competencia(texto_norm)
+    return {
+        'holerite': len(marcadores) >= MIN_MARCADORES and len(marcadores) > len(negativos),
+        'mes': mes,
+        'ano': ano,
+        'marcadores': marcadores,
+    }
+
+
+def classificar_conteudo(conteudo: bytes) -> dict:
+    """
+    Classifica um PDF pela primeira página. Roda dentro dos processos do pool.
+    PDF sem camada de texto (scan) volta com 'sem_texto'; falha de leitura, com 'erro'.
+    """
+    try:
+        reader = PdfReader(io.BytesIO(conteudo))
+        texto = (reader.pages[0].extract_text() or "") if reader.pages else ""
+    except Exception as e:
+        return {'holerite': False, 'mes': None, 'ano': None, 'marcadores': [], 'erro': str(e)[:200]}
+    if not texto.strip():
+        return {'holerite': False, 'mes': None, 'ano': None, 'marcadores': [], 'sem_texto': True}
+    return classificar_texto(texto)
+
+
+def competencia_no_periodo(resultado: dict, filtro_meses: list, filtro_anos: list):
+    """True/False pela competência lida do conteúdo; None se o PDF não traz competência."""
+    if not filtro_meses and not filtro_anos:
+        return True
+    if resultado.get('mes') is None:
+        return None
+    if filtro_anos and resultado['ano'] not in filtro_anos:
+        return False
+    if filtro_meses and resultado['mes'] not in filtro_meses:
+        return False
+    return True
+
+
+def selecionar(resultado: dict, arquivo: dict, filtro_meses: list, filtro_anos: list) -> bool:
+    """
+    Decide se o arquivo entra no resultado. Sem texto legível (scan) ou com erro de
+    leitura, o conteúdo não diz nada e vale o filtro padrão por nome e período.
+    """
+    if resultado.get('erro') or resultado.get('sem_texto'):
+        return eh_holerite(arquivo.get('name', '')) and arquivo_dentro_periodo(arquivo, filtro_meses, filtro_anos)
+    if not resultado['holerite']:
+        return False
+    no_periodo = competencia_no_periodo(resultado, filtro_meses, filtro_anos)
+    if no_periodo is None:
+        no_periodo = arquivo_dentro_periodo(arquivo, filtro_meses, filtro_anos)
+    return no_periodo
+
+
+def _conectar(caminho):
+    con = sqlite3.connect(caminho, timeout=30, isolation_level=None)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS resultados (
+            sha TEXT PRIMARY KEY,
+            dados TEXT NOT NULL,
+            usado_em REAL NOT NULL
+        )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS idx_resultados_uso ON resultados (usado_em)")
+    return con
+
+
+def buscar_cache(shas, caminho=CLASSIFICACAO_DB):
+    """{sha: resultado} dos shas já classificados — lê só essas linhas, não o cache inteiro."""
+    shas = list(shas)
+    encontrados = {}
+    con = _conectar(caminho)
+    try:
+        for i in range(0, len(shas), 500):
+            lote = shas[i:i + 500]
+            marcas = ",".join("?" * len(lote))
+            for sha, dados in con.execute(f"SELECT sha, dados FROM resultados WHERE sha IN ({marcas})", lote):
+                encontrados[sha] = json.loads(dados)
+        if encontrados:
+            achados = list(encontrados)
+            for i in range(0, len(achados), 500):
+                lote = achados[i:i + 500]
+                con.execute(f"UPDATE resultados SET usado_em = ? WHERE sha IN ({','.join('?' * len(lote))})",
+                            [time.time()] + lote)
+    finally:
+        con.close()
+    return encontrados
+
+
+def gravar_cache(resultados, caminho=CLASSIFICACAO_DB):
+    """Grava {sha: resultado} e descarta as entradas menos usadas acima de CACHE_MAX_ENTRADAS."""
+    if not resultados:
+        return
+    agora = time.time()
+    con = _conectar(caminho)
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        con.executemany(
+            "INSERT OR REPLACE INTO resultados (sha, dados, usado_em) VALUES (?, ?, ?)",
+            [(sha, json.dumps(r), agora) for sha, r in resultados.items()],
+        )
+        con.execute("""
+            DELETE FROM resultados WHERE sha IN (
+                SELECT sha FROM resultados ORDER BY usado_em DESC LIMIT -1 OFFSET ?
+            )
+        """, (CACHE_MAX_ENTRADAS,))
+        con.execute("COMMIT")
+    except Exception:
+        if con.in_transaction:
+            con.execute("ROLLBACK")
+    finally:
+        con.close()
+
+
+def _obter_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: não herda threads/sockets do processo do Streamlit
+            _pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def classificar_lote(itens, usar_cache=True, cache_db=CLASSIFICACAO_DB):
+    """
+    Classifica [(sha256, conteudo), ...] e devolve {sha256: resultado}.
+    Só vai para o pool o que não está no cache; conteúdo repetido é lido uma vez.
+    """
+    resultados = buscar_cache({sha for sha, _ in itens}, cache_db) if usar_cache else {}
+    pendentes = {}
+    for sha, conteudo in itens:
+        if sha not in resultados:
+            pendentes.setdefault(sha, conteudo)
+    if not pendentes:
+        return resultados
+
+    shas = list(pendentes)
+    novos = dict(zip(shas, _obter_pool().map(classificar_conteudo, [pendentes[s] for s in shas])))
+    resultados.update(novos)
+    if usar_cache:
+        gravar_cache(novos, cache_db)
+    return resultados
+
+
+def benchmark(pasta):
+    """Compara a vazão (arquivos/s) do filtro só por nome com a classificação por conteúdo."""
+    arquivos = []
+    for nome in sorted(os.listdir(pasta)):
+        if nome.lower().endswith('.pdf'):
+            with open(os.path.join(pasta, nome), 'rb') as f:
+                conteudo = f.read()
+            arquivos.append((nome, hashlib.sha256(conteudo).hexdigest(), conteudo))
+    if not arquivos:
+        print("nenhum PDF encontrado")
+        return
+
+    n = len(arquivos)
+    inicio = time.perf_counter()
+    por_nome = sum(1 for nome, _, _ in arquivos if eh_holerite(nome) and arquivo_dentro_periodo({'name': nome}, [], []))
+    t_nome = time.perf_counter() - inicio
+
+    _obter_pool()  # sobe o pool fora da medição
+    inicio = time.perf_counter()
+    frio = classificar_lote([(sha, c) for _, sha, c in arquivos], usar_cache=False)
+    t_frio = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    for _, _, c in arquivos:
+        classificar_conteudo(c)
+    t_serial = time.perf_counter() - inicio
+
+    # Cache quente de verdade: o mesmo lote contra um arquivo de cache já populado
+    with tempfile.TemporaryDirectory() as diretorio:
+        cache_db = os.path.join(diretorio, "cache.db")
+        gravar_cache(frio, cache_db)
+        inicio = time.perf_counter()
+        quente = classificar_lote([(sha, c) for _, sha, c in arquivos], usar_cache=True, cache_db=cache_db)
+        t_quente = time.perf_counter() - inicio
+
+    por_conteudo = sum(1 for _, sha, _ in arquivos if frio[sha]['holerite'])
+    so_conteudo = sum(1 for nome, sha, _ in arquivos if frio[sha]['holerite'] and not eh_holerite(nome))
+    so_nome = sum(1 for nome, sha, _ in arquivos if eh_holerite(nome) and not frio[sha]['holerite']
+                  and not (frio[sha].get('sem_texto') or frio[sha].get('erro')))
+    ilegiveis = sum(1 for _, sha, _ in arquivos if frio[sha].get('sem_texto') or frio[sha].get('erro'))
+
+    print(f"{n} PDFs em {pasta}")
+    print(f"  só nome              : {n / max(t_nome, 1e-9):>12.0f} arq/s  ({por_nome} holerites)")
+    print(f"  conteúdo, serial     : {n / max(t_serial, 1e-9):>12.1f} arq/s")
+    print(f"  conteúdo, pool ({os.cpu_count()} cpu): {n / max(t_frio, 1e-9):>12.1f} arq/s  ({por_conteudo} holerites)")
+    print(f"  conteúdo, cache      : {len(quente) / max(t_quente, 1e-9):>12.0f} arq/s")
+    print(f"  achados só pelo conteúdo: {so_conteudo} | falsos positivos do nome: {so_nome} | "
+          f"sem texto/ilegíveis (ficam com o nome): {ilegiveis}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "benchmark":
+        print(__doc__)
+        sys.exit(1)
+    if not disponivel():
+        print("pypdf não instalado: pip install pypdf")
+        sys.exit(1)
+    benchmark(sys.argv[2])
@@ -0,0 +1,492 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import requests
+
+from rede import requisitar
+from download import baixar_conteudo
+from deduplicacao import chave_arquivo, resolver_duplicado
+from holerites import (
+    eh_holerite,
+    arquivo_dentro_periodo,
+    deal_criado_no_periodo,
+    nome_deal_valido,
+    produto_deal_valido,
+)
+
+# Arquivo com as contas RD Station adicionais:
+# {"contas": [{"nome": "cliente_a", "client_id": "...", "client_secret": "...", "taxa_por_segundo": 2}]}
+CONTAS_FILE = "rd_contas.json"
+
+TOKEN_URL = "https://api.rd.services/oauth2/token"
+
+# Limite de requisições à API por conta (token bucket)
+TAXA_PADRAO = 2.0
+RAJADA_PADRAO = 5
+
+
+class LimitadorTaxa:
+    """Token bucket: `taxa` requisições/segundo com rajada de até `rajada`."""
+
+    def __init__(self, taxa=TAXA_PADRAO, rajada=RAJADA_PADRAO):
+        self.taxa = taxa
+        self.rajada = rajada
+        self.fichas = float(rajada)
+        self.ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self):
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self.fichas = min(self.rajada, self.fichas + (agora - self.ultimo) * self.taxa)
+                self.ultimo = agora
+                if self.fichas >= 1:
+                    self.fichas -= 1
+                    return
+                espera = (1 - self.fichas) / self.taxa
+            time.sleep(espera)
+
+
+_limitadores = {}
+_limitadores_lock = threading.Lock()
+
+
+def limitador_da_conta(nome, taxa=None, rajada=None):
+    """
+    O limitador da conta `nome` neste processo — o mesmo para todas as sessões do
+    Streamlit, reruns, agendadores e o caminho principal do app. `taxa`/`rajada`,
+    se informadas, atualizam o limitador existente.
+    """
+    with _limitadores_lock:
+        limitador = _limitadores.get(nome)
+        if limitador is None:
+            limitador = _limitadores[nome] = LimitadorTaxa(taxa or TAXA_PADRAO, rajada or RAJADA_PADRAO)
+        else:
+            with limitador._lock:
+                limitador.taxa = taxa or limitador.taxa
+                limitador.rajada = rajada or limitador.rajada
+        return limitador
+
+
+class LimitadorTaxaCompartilhado:
+    """
+    Token bucket em SQLite, compartilhado entre processos (coordenador e workers):
+    todos juntos respeitam `taxa` requisições/segundo da conta.
+    """
+
+    def __init__(self, caminho, chave, taxa=TAXA_PADRAO, rajada=RAJADA_PADRAO):
+        self.caminho = caminho
+        self.chave = chave
+        self.taxa = taxa
+        self.rajada = rajada
+        con = self._conectar()
+        try:
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS limites_taxa (
+                    chave TEXT PRIMARY KEY,
+                    fichas REAL NOT NULL,
+                    ultimo REAL NOT NULL
+                )
+            """)
+            con.execute(
+                "INSERT OR IGNORE INTO limites_taxa (chave, fichas, ultimo) VALUES (?, ?, ?)",
+                (chave, float(rajada), time.time())
+            )
+        finally:
+            con.close()
+
+    def _conectar(self):
+        con = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        return con
+
+    def adquirir(self):
+        while True:
+            con = self._conectar()
+            try:
+                con.execute("BEGIN IMMEDIATE")
+                fichas, ultimo = con.execute(
+                    "SELECT fichas, ultimo FROM limites_taxa WHERE chave = ?", (self.chave,)
+                ).fetchone()
+                agora = time.time()
+                fichas = min(self.rajada, fichas + max(0.0, agora - ultimo) * self.taxa)
+                if fichas >= 1:
+                    fichas -= 1
+                    espera = 0
+                else:
+                    espera = (1 - fichas) / self.taxa
+                con.execute(
+                    "UPDATE limites_taxa SET fichas = ?, ultimo = ? WHERE chave = ?", (fichas, agora, self.chave)
+                )
+                con.execute("COMMIT")
+            except Exception:
+                if con.in_transaction:
+                    con.execute("ROLLBACK")
+                raise
+            finally:
+                con.close()
+            if not espera:
+                return
+            time.sleep(espera)
+
+
+class ArmazemTokens:
+    """Tokens OAuth2 de uma conta, persistidos no seu próprio arquivo."""
+
+    def __init__(self, caminho, client_id, client_secret):
+        self.caminho = caminho
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self._lock = threading.Lock()
+
+    def carregar(self):
+        if not os.path.exists(self.caminho):
+            return None
+        try:
+            with open(self.caminho, 'r') as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def salvar(self, data):
+        tokens = {
+            'access_token': data['access_token'],
+            'refresh_token': data['refresh_token'],
+            'expires_at': (datetime.now() + timedelta(seconds=data['expires_in'])).isoformat()
+        }
+        # Escrita atômica: outros processos nunca leem o arquivo pela metade
+        temporario = f"{self.caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporario, 'w') as f:
+            json.dump(tokens, f)
+        os.replace(temporario, self.caminho)
+        return tokens
+
+    def _pedir_token(self, payload):
+        response = requisitar(
+            "POST", TOKEN_URL, classe="auth", data=payload,
+            headers={'Content-Type': 'application/x-www-form-urlencoded'}
+        )
+        return self.salvar(response.json())
+
+    def obter_por_codigo(self, authorization_code, redirect_uri):
+        with self._lock:
+            return self._pedir_token({
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'code': authorization_code,
+                'redirect_uri': redirect_uri,
+                'grant_type': 'authorization_code'
+            })
+
+    def _renovar(self, refresh_token):
+        try:
+            return self._pedir_token({
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'refresh_token': refresh_token,
+                'grant_type': 'refresh_token'
+            })
+        except Exception as e:
+            atual = self.carregar()
+            if atual and atual.get('refresh_token') != refresh_token:
+                return atual  # outra sessão/processo já renovou com o mesmo refresh token
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            if isinstance(e, requests.exceptions.HTTPError) and status in (400, 401) and atual:
+                # Refresh token recusado: a conta precisa ser autorizada de novo
+                os.remove(self.caminho)
+            return None
+
+    def access_token(self, forcar_renovacao=False):
+        """
+        Token válido (renova se faltar menos de 10 min) ou None se a conta não está autorizada.
+        Sem client_secret (contas dos workers) não renova: usa o token do arquivo enquanto
+        não expira — quem renova é o coordenador.
+        """
+        with self._lock:
+            tokens = self.carregar()
+            if not tokens:
+                return None
+            expiry = datetime.fromisoformat(tokens['expires_at'])
+            if forcar_renovacao or expiry < datetime.now() + timedelta(minutes=10):
+                if not self.client_secret:
+                    return tokens['access_token'] if expiry > datetime.now() else None
+                tokens = self._renovar(tokens['refresh_token'])
+            return tokens['access_token'] if tokens else None
+
+
+class Conta:
+    """Uma conta RD Station com armazém de tokens, limitador e processados próprios."""
+
+    def __init__(self, nome, client_id=None, client_secret=None, token_file=None, processed_file=None,
+                 taxa_por_segundo=TAXA_PADRAO):
+        self.nome = nome
+        self.client_id = client_id
+        self.tokens = ArmazemTokens(token_file or f"rd_tokens_{nome}.json", client_id, client_secret)
+        self.processed_file = processed_file or f"processed_leads_{nome}.json"
+        self.limitador = limitador_da_conta(nome, taxa_por_segundo)
+
+    def config(self):
+        """
+        Configuração serializável, sem credenciais — `Conta(**config)` em outro processo
+        lê os tokens do arquivo mas não os renova.
+        """
+        return {
+            'nome': self.nome,
+            'token_file': self.tokens.caminho,
+            'processed_file': self.processed_file,
+            'taxa_por_segundo': self.limitador.taxa,
+        }
+
+    def com_limitador(self, limitador):
+        """Cópia da conta (mesmo armazém de tokens) usando outro limitador de taxa."""
+        copia = copy.copy(self)
+        copia.limitador = limitador
+        return copia
+
+    def autorizada(self) -> bool:
+        return self.tokens.carregar() is not None
+
+    def get(self, url, params=None):
+        self.limitador.adquirir()
+        token = self.tokens.access_token()
+        if not token:
+            raise Exception(f"Conta {self.nome} sem token válido")
+        return requisitar(
+            "GET", url, classe="api", params=params,
+            headers={"Authorization": f"Bearer {token}"},
+            renovar_token=lambda: self.tokens.access_token(forcar_renovacao=True),
+        )
+
+    def carregar_processados(self):
+        if not os.path.exists(self.processed_file):
+            return set()
+        try:
+            with open(self.processed_file, 'r') as f:
+                return set(json.load(f) or [])
+        except Exception:
+            return set()
+
+    def salvar_processados(self, keys_set):
+        try:
+            with open(self.processed_file, 'w') as f:
+                json.dump(sorted(list(keys_set)), f)
+        except Exception:
+            pass
+
+    def listar_deals(self, meses=None, anos=None, ignorar_processados=False, max_paginas=100, max_deals=100,
+                     antes_da_pagina=None):
+        """
+        Gera os deals filtrados página a página (filtros de nome/produto/período locais).
+        `antes_da_pagina` é chamado antes de cada requisição de página (ex.: cobrar um orçamento).
+        """
+        url = "https://api.rd.services/crm/v2/deals"
+        processados = set() if ignorar_processados else self.carregar_processados()
+        total = 0
+        for pagina in range(1, max_paginas + 1):
+            if antes_da_pagina:
+                antes_da_pagina()
+            dados = self.get(url, {"page[number]": pagina, "page[size]": 100}).json()
+            deals_pagina = dados.get('data', [])
+            if not deals_pagina:
+                return
+            for d in deals_pagina:
+                if not (nome_deal_valido(d.get("name", "")) and produto_deal_valido(d)):
+                    continue
+                if (meses or anos) and not deal_criado_no_periodo(d, meses or [], anos or []):
+                    continue
+                if d.get('id') in processados:
+                    continue
+                yield d
+                total += 1
+                if total >= max_deals:
+                    return
+            if not dados.get('links', {}).get('next'):
+                return
+
+    def baixar_holerites_deal(self, deal_id, filtro_meses=None, filtro_anos=None, hedge=False, erros=None,
+                              antes_do_arquivo=None):
+        """
+        Holerites do deal. Um PDF que falha não derruba os outros: o erro vai para
+        a lista `erros` (se informada) e o arquivo fica de fora.
+        `antes_do_arquivo` é chamado antes de cada download (pode levantar para interromper).
+        """
+        url = f"https://api.rd.services/crm/v2/deals/{deal_id}/files"
+        arquivos = self.get(url).json().get('data', [])
+        holerites = []
+        for arquivo in arquivos:
+            nome = arquivo.get('name', '')
+            if not eh_holerite(nome):
+                continue
+            if not arquivo_dentro_periodo(arquivo, filtro_meses or [], filtro_anos or []):
+                continue
+            if antes_do_arquivo:
+                antes_do_arquivo()
+            try:
+                conteudo, info = baixar_conteudo(arquivo.get('url'), hedge=hedge)
+            except Exception as e:
+                if erros is not None:
+                    erros.append(f"{nome}: {e}")
+                continue
+            holerites.append({
+                'nome': nome,
+                'deal_id': deal_id,
+                'conteudo': conteudo,
+                'tamanho': len(conteudo),
+                'sha256': info['sha256'],
+            })
+        return holerites
+
+
+def carregar_contas(conta_padrao=None):
+    """Conta padrão (se informada) + contas do CONTAS_FILE."""
+    contas = [conta_padrao] if conta_padrao else []
+    if not os.path.exists(CONTAS_FILE):
+        return contas
+    try:
+        with open(CONTAS_FILE, 'r') as f:
+            data = json.load(f)
+    except Exception:
+        return contas
+    nomes = {c.nome for c in contas}
+    for cfg in data.get('contas', []):
+        if not cfg.get('nome') or cfg['nome'] in nomes:
+            continue
+        contas.append(Conta(
+            cfg['nome'],
+            cfg['client_id'],
+            cfg['client_secret'],
+            token_file=cfg.get('token_file'),
+            processed_file=cfg.get('processed_file'),
+            taxa_por_segundo=cfg.get('taxa_por_segundo', TAXA_PADRAO),
+        ))
+        nomes.add(cfg['nome'])
+    return contas
+
+
+class AgendadorContas:
+    """
+    Exporta várias contas em paralelo. Cada conta lista seus deals numa thread
+    própria; os downloads vão para filas por conta e um pool compartilhado de
+    trabalhadores as atende em round-robin, para que uma conta grande não
+    monopolize os trabalhadores.
+    """
+
+    def __init__(self, contas, trabalhadores=4, hedge=False):
+        self.contas = {c.nome: c for c in contas}
+        self.trabalhadores = trabalhadores
+        self.hedge = hedge
+        self._filas = {nome: deque() for nome in self.contas}
+        self._ordem = list(self.contas)
+        self._cursor = 0
+        self._listando = set(self.contas)
+        self._cond = threading.Condition()
+        self._progresso = {
+            nome: {'deals': 0, 'deals_concluidos': 0, 'holerites': 0, 'bytes': 0,
+                   'duplicados': 0, 'erros': [], 'listagem_concluida': False, 'concluida': False}
+            for nome in self.contas
+        }
+        self._resultados = {nome: [] for nome in self.contas}
+        self._hashes = {nome: {} for nome in self.contas}
+        self._novos_processados = {nome: set() for nome in self.contas}
+
+    def progresso(self):
+        """Cópia do progresso por conta (seguro para chamar de outra thread)."""
+        with self._cond:
+            return {nome: dict(p, erros=list(p['erros'])) for nome, p in self._progresso.items()}
+
+    def _listar(self, conta, meses, anos, max_paginas, max_deals):
+        usando_filtro_data = bool(meses or anos)
+        try:
+            for deal in conta.listar_deals(meses, anos, ignorar_processados=usando_filtro_data,
+                                           max_paginas=max_paginas, max_deals=max_deals):
+                with self._cond:
+                    self._filas[conta.nome].append(deal)
+                    self._progresso[conta.nome]['deals'] += 1
+                    self._cond.notify()
+        except Exception as e:
+            with self._cond:
+                self._progresso[conta.nome]['erros'].append(f"Listagem: {e}")
+        finally:
+            with self._cond:
+                self._listando.discard(conta.nome)
+                self._progresso[conta.nome]['listagem_concluida'] = True
+                self._atualizar_concluida(conta.nome)
+                self._cond.notify_all()
+
+    def _atualizar_concluida(self, nome):
+        p = self._progresso[nome]
+        p['concluida'] = p['listagem_concluida'] and p['deals_concluidos'] >= p['deals']
+
+    def _proximo_item(self):
+        """Próximo (conta, deal) em round-robin; None quando tudo acabou."""
+        with self._cond:
+            while True:
+                for _ in range(len(self._ordem)):
+                    nome = self._ordem[self._cursor % len(self._ordem)]
+                    self._cursor += 1
+                    if self._filas[nome]:
+                        return nome, self._filas[nome].popleft()
+                if not self._listando:
+                    return None
+                self._cond.wait()
+
+    def _trabalhar(self, meses, anos):
+        usando_filtro_data = bool(meses or anos)
+        while True:
+            item = self._proximo_item()
+            if item is None:
+                return
+            nome, deal = item
+            conta = self.contas[nome]
+            deal_id = deal.get('id')
+            erros_arquivos = []
+            try:
+                holerites = conta.baixar_holerites_deal(deal_id, meses, anos, hedge=self.hedge, erros=erros_arquivos)
+                erro = f"Deal {deal_id}: " + "; ".join(erros_arquivos) if erros_arquivos else None
+            except Exception as e:
+                holerites, erro = [], f"Deal {deal_id}: {e}"
+            with self._cond:
+                p = self._progresso[nome]
+                for h in holerites:
+                    chave = chave_arquivo(deal_id, h['nome'])
+                    if resolver_duplicado(h['sha256'], chave, self._hashes[nome], {}, entre_execucoes=False):
+                        p['duplicados'] += 1
+                        continue
+                    self._hashes[nome][h['sha256']] = chave
+                    self._resultados[nome].append(h)
+                    p['holerites'] += 1
+                    p['bytes'] += h['tamanho']
+                if erro:
+                    # Com arquivo faltando o deal não vira processado: a próxima execução tenta de novo
+                    p['erros'].append(erro)
+                elif holerites and deal_id and not usando_filtro_data:
+                    self._novos_processados[nome].add(deal_id)
+                p['deals_concluidos'] += 1
+                self._atualizar_concluida(nome)
+
+    def executar(self, meses=None, anos=None, max_paginas=100, max_deals=100):
+        """Roda a exportação e devolve {nome_conta: [holerites]}."""
+        threads = [
+            threading.Thread(target=self._listar, args=(conta, meses, anos, max_paginas, max_deals), daemon=True)
+            for conta in self.contas.values()
+        ] + [
+            threading.Thread(target=self._trabalhar, args=(meses, anos), daemon=True)
+            for _ in range(self.trabalhadores)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for nome, novos in self._novos_processados.items():
+            if novos:
+                conta = self.contas[nome]
+                conta.salvar_processados(conta.carregar_processados() | novos)
+        return self._resultados
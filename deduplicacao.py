@@ -0,0 +1,71 @@
+import json
+import os
+
+HASH_INDEX_FILE = "holerites_hashes.json"
+MANIFEST_FILE = "holerites_manifest.json"
+
+
+def nome_seguro(nome: str) -> str:
+    """Remove caracteres que não podem ir para o nome do arquivo no ZIP."""
+    return "".join(c for c in (nome or '') if c.isalnum() or c in (' ', '.', '_', '-'))
+
+
+def chave_arquivo(deal_id, nome: str) -> str:
+    """Chave do arquivo no índice/manifesto — a mesma usada como nome dentro do ZIP."""
+    return f"{deal_id}_{nome_seguro(nome)}"
+
+
+def _carregar_json(caminho):
+    if not os.path.exists(caminho):
+        return {}
+    try:
+        with open(caminho, 'r') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def _salvar_json(caminho, data):
+    try:
+        with open(caminho, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+    except Exception:
+        pass
+
+
+def carregar_indice_hashes():
+    """Índice persistente sha256 -> chave do arquivo canônico."""
+    return _carregar_json(HASH_INDEX_FILE)
+
+
+def salvar_indice_hashes(indice):
+    _salvar_json(HASH_INDEX_FILE, indice)
+
+
+def carregar_manifesto():
+    """Manifesto persistente chave duplicada -> {'canonico', 'sha256'}."""
+    return _carregar_json(MANIFEST_FILE)
+
+
+def salvar_manifesto(manifesto):
+    _salvar_json(MANIFEST_FILE, manifesto)
+
+
+def resolver_duplicado(sha, chave, hashes_execucao, indice_hashes, entre_execucoes=True):
+    """
+    Decide se o conteúdo `sha` já foi visto.
+    - Dentro da execução atual: qualquer repetição é duplicada.
+    - Entre execuções (índice persistente): duplicada só se o canônico for outro arquivo.
+    Retorna a chave canônica quando for duplicado, senão None.
+    """
+    if not sha:
+        return None
+    canonico = hashes_execucao.get(sha)
+    if canonico is not None:
+        return canonico
+    if entre_execucoes:
+        canonico = indice_hashes.get(sha)
+        if canonico is not None and canonico != chave:
+            return canonico
+    return None
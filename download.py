@@ -0,0 +1,284 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+from rede import requisitar
+
+DOWNLOAD_DIR = "downloads_tmp"
+CHUNK_SIZE = 64 * 1024
+
+# Quantas vezes uma transferência interrompida é retomada via Range
+MAX_RETOMADAS = 5
+
+# Hedging: só dispara depois de ter amostras suficientes para estimar o p95
+HEDGE_MIN_AMOSTRAS = 20
+HEDGE_PERCENTIL = 95
+
+# Janela de latências mantida para os percentis
+JANELA_LATENCIAS = 1000
+
+ERROS_INTERRUPCAO = (
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+class TransferenciaCancelada(Exception):
+    """A outra cópia (hedge) terminou primeiro."""
+
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    idx = min(len(ordenados) - 1, max(0, int(round(p / 100 * len(ordenados))) - 1))
+    return ordenados[idx]
+
+
+class EstatisticasLatencia:
+    """
+    Latência por arquivo das transferências. Quando o hedge vence, a primária é
+    cancelada e a latência "sem hedge" daquele arquivo fica censurada: só se sabe
+    que seria maior que o tempo decorrido. `resumo` estima esses valores a partir
+    das latências não censuradas acima desse ponto.
+    """
+
+    def __init__(self):
+        self.registros = []
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def registrar(self, latencia, hedge_disparado, hedge_venceu, retomadas):
+        with self._lock:
+            registro = {
+                'seq': self._seq,
+                'latencia': latencia,
+                'censurado': hedge_venceu,
+                'hedge_disparado': hedge_disparado,
+                'hedge_venceu': hedge_venceu,
+                'retomadas': retomadas,
+            }
+            self._seq += 1
+            self.registros.append(registro)
+            if len(self.registros) > JANELA_LATENCIAS:
+                del self.registros[:len(self.registros) - JANELA_LATENCIAS]
+        return registro
+
+    def marcar(self):
+        """Número de sequência atual — use com `resumo(desde=...)` para medir uma execução."""
+        with self._lock:
+            return self._seq
+
+    def limiar_hedge(self):
+        with self._lock:
+            latencias = [r['latencia'] for r in self.registros]
+        if len(latencias) < HEDGE_MIN_AMOSTRAS:
+            return None
+        return percentil(latencias, HEDGE_PERCENTIL)
+
+    def latencias_sem_hedge(self):
+        """Latências observadas sem interferência do hedge (não censuradas)."""
+        with self._lock:
+            return [r['latencia'] for r in self.registros if not r['censurado']]
+
+    def resumo(self, desde=0, referencia=None):
+        """
+        Percentis dos registros com seq >= `desde`. `referencia` (outra instância,
+        ex.: a global) fornece a distribuição usada para estimar os censurados.
+        """
+        with self._lock:
+            registros = [r for r in self.registros if r['seq'] >= desde]
+        latencias = [r['latencia'] for r in registros]
+        observadas = sorted((referencia or self).latencias_sem_hedge())
+        sem_hedge = []
+        for r in registros:
+            if not r['censurado']:
+                sem_hedge.append(r['latencia'])
+                continue
+            acima = [x for x in observadas if x > r['latencia']]
+            sem_hedge.append(acima[len(acima) // 2] if acima else r['latencia'])
+        return {
+            'arquivos': len(registros),
+            'p50': percentil(latencias, 50),
+            'p95': percentil(latencias, 95),
+            'p99': percentil(latencias, 99),
+            'p99_sem_hedge': percentil(sem_hedge, 99),
+            'hedges': sum(1 for r in registros if r['hedge_disparado']),
+            'hedges_vencedores': sum(1 for r in registros if r['hedge_venceu']),
+            'retomadas': sum(r['retomadas'] for r in registros),
+        }
+
+
+ESTATISTICAS = EstatisticasLatencia()
+
+
+def _tamanho_total(resp, offset):
+    """Tamanho final esperado a partir de Content-Range/Content-Length (ou None)."""
+    content_range = resp.headers.get('Content-Range')
+    if resp.status_code == 206 and content_range and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total.isdigit() else None
+    content_length = resp.headers.get('Content-Length')
+    if content_length and content_length.isdigit():
+        return int(content_length) + (offset if resp.status_code == 206 else 0)
+    return None
+
+
+def _transferir(url, caminho, cancelado):
+    """
+    Baixa `url` para `caminho` em chunks, calculando o SHA-256 durante o streaming.
+    Se a conexão cair no meio, retoma do último byte gravado com `Range`.
+    Retorna (tamanho, sha256_hex, retomadas).
+    """
+    offset = 0
+    sha = hashlib.sha256()
+    retomadas = 0
+    try:
+        while True:
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            try:
+                resp = requisitar("GET", url, classe="arquivo", headers=headers, stream=True)
+            except requests.exceptions.HTTPError as e:
+                status = getattr(e.response, 'status_code', None)
+                if status == 416 and offset:
+                    # Range inválido para o servidor — recomeça do zero
+                    offset, sha = 0, hashlib.sha256()
+                    continue
+                raise
+
+            if offset and resp.status_code != 206:
+                # Servidor ignorou o Range: recomeça do zero
+                offset, sha = 0, hashlib.sha256()
+            total = _tamanho_total(resp, offset)
+
+            interrompido = False
+            try:
+                with open(caminho, 'ab' if offset else 'wb') as f:
+                    for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                        if cancelado.is_set():
+                            raise TransferenciaCancelada()
+                        if not chunk:
+                            continue
+                        f.write(chunk)
+                        sha.update(chunk)
+                        offset += len(chunk)
+            except ERROS_INTERRUPCAO:
+                interrompido = True
+            finally:
+                resp.close()
+
+            # Sem Content-Length (chunked) só o fim limpo do stream garante o arquivo
+            # completo; interrompido, retoma com Range como no caso de tamanho conhecido
+            if not interrompido and (total is None or offset >= total):
+                return offset, sha.hexdigest(), retomadas
+
+            retomadas += 1
+            if retomadas > MAX_RETOMADAS:
+                raise IOError(
+                    f"Transferência incompleta após {MAX_RETOMADAS} retomadas: "
+                    f"{offset}/{total if total is not None else '?'} bytes"
+                )
+    except BaseException:
+        if os.path.exists(caminho):
+            os.remove(caminho)
+        raise
+
+
+def _descartar_parcial(caminho):
+    if os.path.exists(caminho):
+        os.remove(caminho)
+
+
+def baixar_para_disco(url, destino, hedge=False, estatisticas=ESTATISTICAS, coleta=None):
+    """
+    Baixa `url` para o arquivo `destino`.
+    Com `hedge=True`, se a transferência passar do p95 observado, dispara uma
+    segunda requisição em paralelo, fica com a que terminar primeiro e cancela a outra.
+    Com `coleta` (outra EstatisticasLatencia), o registro também vai para ela —
+    uma coleta por execução isola o resumo de outras sessões.
+    Retorna dict com 'tamanho', 'sha256', 'latencia', 'retomadas' e 'hedge_venceu'.
+    """
+    def registrar(latencia, hedge_disparado, hedge_venceu, retomadas):
+        for destino_stats in (estatisticas, coleta):
+            if destino_stats is not None:
+                destino_stats.registrar(latencia, hedge_disparado, hedge_venceu, retomadas)
+
+    inicio = time.monotonic()
+    limiar = estatisticas.limiar_hedge() if hedge else None
+
+    if limiar is None:
+        tamanho, sha256, retomadas = _transferir(url, destino, threading.Event())
+        latencia = time.monotonic() - inicio
+        registrar(latencia, False, False, retomadas)
+        return {'tamanho': tamanho, 'sha256': sha256, 'latencia': latencia,
+                'retomadas': retomadas, 'hedge_venceu': False}
+
+    pool = ThreadPoolExecutor(max_workers=2)
+    partes = {}
+    cancelar = {}
+    try:
+        cancelar['a'] = threading.Event()
+        primario = pool.submit(_transferir, url, destino + ".a.part", cancelar['a'])
+        partes[primario] = 'a'
+        feitos, _ = wait([primario], timeout=limiar)
+        if feitos:
+            tamanho, sha256, retomadas = primario.result()
+            os.replace(destino + ".a.part", destino)
+            latencia = time.monotonic() - inicio
+            registrar(latencia, False, False, retomadas)
+            return {'tamanho': tamanho, 'sha256': sha256, 'latencia': latencia,
+                    'retomadas': retomadas, 'hedge_venceu': False}
+
+        cancelar['b'] = threading.Event()
+        copia = pool.submit(_transferir, url, destino + ".b.part", cancelar['b'])
+        partes[copia] = 'b'
+        pendentes = {primario, copia}
+        falhas = []
+        while pendentes:
+            feitos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+            # As duas podem terminar no mesmo `wait`: só desiste se nenhuma deu certo
+            sucessos = [f for f in feitos if f.exception() is None]
+            falhas.extend(f.exception() for f in feitos if f.exception() is not None)
+            if not sucessos:
+                if not pendentes:
+                    raise falhas[0]
+                continue
+            futuro = primario if primario in sucessos else copia
+            hedge_venceu = futuro is copia
+            latencia = time.monotonic() - inicio
+            tamanho, sha256, retomadas = futuro.result()
+            os.replace(destino + f".{partes[futuro]}.part", destino)
+            registrar(latencia, True, hedge_venceu, retomadas)
+            # Cancela a perdedora; se ela já terminou (inclusive no mesmo `wait`),
+            # o callback apaga o .part que sobrou
+            perdedora = copia if futuro is primario else primario
+            cancelar[partes[perdedora]].set()
+            perdedora.add_done_callback(
+                lambda f, caminho=destino + f".{partes[perdedora]}.part": _descartar_parcial(caminho)
+            )
+            return {'tamanho': tamanho, 'sha256': sha256, 'latencia': latencia,
+                    'retomadas': retomadas, 'hedge_venceu': hedge_venceu}
+    finally:
+        # Não espera a cópia perdedora: ela sai sozinha no próximo chunk
+        pool.shutdown(wait=False)
+
+
+def baixar_conteudo(url, hedge=False, coleta=None):
+    """Baixa via disco e devolve (conteudo, info) — o arquivo temporário é removido."""
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    fd, caminho = tempfile.mkstemp(suffix=".pdf", dir=DOWNLOAD_DIR)
+    os.close(fd)
+    try:
+        info = baixar_para_disco(url, caminho, hedge=hedge, coleta=coleta)
+        with open(caminho, 'rb') as f:
+            conteudo = f.read()
+        return conteudo, info
+    finally:
+        if os.path.exists(caminho):
+            os.remove(caminho)
@@ -0,0 +1,214 @@
+from datetime import datetime
+
+# Mapa de meses PT -> número e variações de nome
+MESES_MAP = {
+    1:  ["janeiro"],
+    2:  ["fevereiro"],
+    3:  ["março", "marco"],
+    4:  ["abril"],
+    5:  ["maio"],
+    6:  ["junho"],
+    7:  ["julho"],
+    8:  ["agosto"],
+    9:  ["setembro"],
+    10: ["outubro"],
+    11: ["novembro"],
+    12: ["dezembro"],
+}
+
+MESES_NOMES_PT = [
+    "Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho",
+    "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"
+]
+
+# Palavras-chave base para identificar holerites (sem meses — adicionados dinamicamente)
+PALAVRAS_CHAVE_BASE = [
+    "contra cheque", "holerite", "contracheque", "folha de pagamento"
+]
+
+# Palavras-chave completas (base + todos os meses)
+PALAVRAS_CHAVE_HOLERITE = PALAVRAS_CHAVE_BASE + [
+    variacao
+    for variantes in MESES_MAP.values()
+    for variacao in variantes
+]
+
+
+def mes_numero_para_palavras(mes_num: int) -> list[str]:
+    """Retorna as variações de nome do mês em português."""
+    return MESES_MAP.get(mes_num, [])
+
+
+def holerite_corresponde_periodo(nome_arquivo: str, meses: list[int], anos: list[int]) -> bool:
+    """
+    Verifica se o nome do arquivo corresponde a algum dos meses E anos fornecidos.
+    - Se meses ou anos estiverem vazios, não aplica esse filtro.
+    """
+    nome = nome_arquivo.lower().strip()
+
+    # Filtro por mês
+    if meses:
+        palavras_meses = [
+            variacao
+            for m in meses
+            for variacao in mes_numero_para_palavras(m)
+        ]
+        tem_mes = any(p in nome for p in palavras_meses)
+        if not tem_mes:
+            return False
+
+    # Filtro por ano
+    if anos:
+        tem_ano = any(str(a) in nome for a in anos)
+        if not tem_ano:
+            return False
+
+    return True
+
+
+def eh_holerite(nome_arquivo: str) -> bool:
+    nome = nome_arquivo.lower().strip()
+    if not nome.endswith('.pdf'):
+        return False
+    return any(palavra in nome for palavra in PALAVRAS_CHAVE_HOLERITE)
+
+
+def _rdql_or(field, values):
+    values = [v for v in (values or []) if v]
+    if not values:
+        return None
+    if len(values) == 1:
+        return f"{field}:{values[0]}"
+    return "(" + " OR ".join(f"{field}:{v}" for v in values) + ")"
+
+
+def _rdql_and(parts):
+    parts = [p for p in (parts or []) if p]
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    return " AND ".join(parts)
+
+
+def build_deals_rdql_filter(pipeline_id=None, stage_ids=None, organization_ids=None):
+    """Monta filtro RDQL apenas para campos que a API suporta sem erros."""
+    parts = []
+    if pipeline_id:
+        parts.append(f"pipeline_id:{pipeline_id}")
+    parts.append(_rdql_or("stage_id", stage_ids))
+    parts.append(_rdql_or("organization_id", organization_ids))
+    return _rdql_and(parts)
+
+
+def deal_criado_no_periodo(deal: dict, meses: list, anos: list) -> bool:
+    """
+    Filtra localmente pelo campo created_at do deal.
+    Retorna True se o deal foi criado no(s) mês(es) e ano(s) selecionados.
+    Se meses e anos estiverem vazios, aceita tudo.
+    """
+    if not meses and not anos:
+        return True
+
+    created_raw = deal.get('created_at') or deal.get('inserted_at')
+    if not created_raw:
+        # Sem data no deal, não conseguimos filtrar — inclui por segurança
+        return True
+
+    try:
+        dt = datetime.fromisoformat(created_raw.replace('Z', '+00:00'))
+        if anos and dt.year not in anos:
+            return False
+        if meses and dt.month not in meses:
+            return False
+        return True
+    except Exception:
+        return True  # se não conseguir parsear, inclui
+
+
+PRODUTOS_BLOQUEADOS = {"compra de divida", "portabilidade"}
+
+
+def nome_deal_valido(nome: str) -> bool:
+    if not nome:
+        return True
+    nome_norm = nome.strip().lower()
+    if nome_norm.startswith("port") or nome_norm.endswith("port"):
+        return False
+    return True
+
+
+def produto_deal_valido(deal: dict) -> bool:
+    produto = (
+        deal.get("product_name")
+        or deal.get("product")
+        or deal.get("custom_fields", {}).get("produto")
+        or ""
+    )
+    return produto.strip().lower() not in PRODUTOS_BLOQUEADOS
+
+
+def arquivo_dentro_periodo(arquivo: dict, filtro_meses: list, filtro_anos: list) -> bool:
+    """
+    Verifica se o arquivo está dentro do período selecionado.
+    Prioridade:
+      1. Campo created_at do arquivo (se existir) — mais confiável
+      2. Fallback: procura mês/ano no nome do arquivo
+    """
+    usar_meses = bool(filtro_meses)
+    usar_anos  = bool(filtro_anos)
+
+    if not usar_meses and not usar_anos:
+        return True  # sem filtro, aceita tudo
+
+    # --- Tentativa 1: usar created_at do arquivo ---
+    created_raw = arquivo.get('created_at') or arquivo.get('uploaded_at') or arquivo.get('inserted_at')
+    if created_raw:
+        try:
+            # Suporta ISO 8601 com ou sem timezone
+            dt = datetime.fromisoformat(created_raw.replace('Z', '+00:00'))
+            if usar_anos and dt.year not in filtro_anos:
+                return False
+            if usar_meses and dt.month not in filtro_meses:
+                return False
+            return True
+        except Exception:
+            pass  # cai no fallback
+
+    # --- Fallback: procurar no nome do arquivo ---
+    nome = (arquivo.get('name') or '').lower()
+    if usar_anos:
+        if not any(str(a) in nome for a in filtro_anos):
+            return False
+    if usar_meses:
+        palavras_meses = [v for m in filtro_meses for v in mes_numero_para_palavras(m)]
+        if not any(p in nome for p in palavras_meses):
+            return False
+    return True
+
+
+def filtrar_deals(deals, pipeline_id=None, stage_ids=None, organization_ids=None,
+                  meses=None, anos=None, processados=None):
+    """Aplica localmente os filtros de pipeline/estágio/organização, nome/produto, período e processados."""
+    if pipeline_id:
+        deals = [d for d in deals if d.get('pipeline_id') == pipeline_id]
+    if stage_ids:
+        stage_ids_set = set(stage_ids)
+        deals = [d for d in deals if d.get('stage_id') in stage_ids_set]
+    if organization_ids:
+        org_ids_set = set(organization_ids)
+        deals = [
+            d for d in deals
+            if d.get('organization_id') in org_ids_set and d.get('organization_id') is not None
+        ]
+
+    # Filtro local por nome/produto
+    deals = [d for d in deals if nome_deal_valido(d.get("name", "")) and produto_deal_valido(d)]
+
+    # Filtro local por data de criação do deal (created_at)
+    if meses or anos:
+        deals = [d for d in deals if deal_criado_no_periodo(d, meses or [], anos or [])]
+
+    if processados:
+        deals = [d for d in deals if d.get('id') not in processados]
+    return deals
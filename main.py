@@ -6,6 +6,49 @@ from datetime import datetime, timedelta, date
 import zipfile
 import io
 import json
+import math
+import hashlib
+import threading
+
+from deduplicacao import (
+    chave_arquivo,
+    carregar_indice_hashes,
+    salvar_indice_hashes,
+    carregar_manifesto,
+    salvar_manifesto,
+    resolver_duplicado,
+)
+from rede import requisitar
+from holerites import (
+    MESES_NOMES_PT,
+    eh_holerite,
+    build_deals_rdql_filter,
+    arquivo_dentro_periodo,
+    filtrar_deals,
+)
+from download import baixar_conteudo, EstatisticasLatencia, ESTATISTICAS as ESTATISTICAS_DOWNLOAD
+from contas import Conta, AgendadorContas, carregar_contas, limitador_da_conta
+from workers import FilaDeals, coordenar, iniciar_workers, marcar_processados
+import classificacao
+from webhook import (
+    EstadoLocal,
+    sincronizar_deals,
+    iniciar_em_segundo_plano,
+    receptor_ativo,
+    endereco_receptor,
+    PORTA_PADRAO,
+)
+from prefetch import (
+    ArmazemQuente,
+    agendador_do_processo,
+    registrar_periodo_pedido,
+    prever_periodos,
+    carregar_historico,
+    descrever_periodo,
+)
+
+# Início do rerun — medido no rodapé (painel de desempenho)
+_inicio_rerun = time.perf_counter()
 
 # Configuração da página
 st.set_page_config(
@@ -24,6 +67,9 @@ PROCESSED_FILE = "processed_leads.json"
 MAX_PAGINAS = 100
 MAX_DEALS = 100
 
+# Conta RD Station padrão — contas adicionais vêm de rd_contas.json (ver contas.py)
+CONTA_PADRAO = "principal"
+
 # Detecta automaticamente a URL do Streamlit
 def get_redirect_uri():
     """Detecta a URL atual do Streamlit"""
@@ -98,72 +144,16 @@ if 'access_token' not in st.session_state:
     st.session_state.access_token = None
 if 'token_expiry' not in st.session_state:
     st.session_state.token_expiry = None
-
-# Mapa de meses PT -> número e variações de nome
-MESES_MAP = {
-    1:  ["janeiro"],
-    2:  ["fevereiro"],
-    3:  ["março", "marco"],
-    4:  ["abril"],
-    5:  ["maio"],
-    6:  ["junho"],
-    7:  ["julho"],
-    8:  ["agosto"],
-    9:  ["setembro"],
-    10: ["outubro"],
-    11: ["novembro"],
-    12: ["dezembro"],
-}
-
-MESES_NOMES_PT = [
-    "Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho",
-    "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"
-]
-
-# Palavras-chave base para identificar holerites (sem meses — adicionados dinamicamente)
-PALAVRAS_CHAVE_BASE = [
-    "contra cheque", "holerite", "contracheque", "folha de pagamento"
-]
-
-# Palavras-chave completas (base + todos os meses)
-PALAVRAS_CHAVE_HOLERITE = PALAVRAS_CHAVE_BASE + [
-    variacao
-    for variantes in MESES_MAP.values()
-    for variacao in variantes
-]
-
-
-def mes_numero_para_palavras(mes_num: int) -> list[str]:
-    """Retorna as variações de nome do mês em português."""
-    return MESES_MAP.get(mes_num, [])
-
-
-def holerite_corresponde_periodo(nome_arquivo: str, meses: list[int], anos: list[int]) -> bool:
-    """
-    Verifica se o nome do arquivo corresponde a algum dos meses E anos fornecidos.
-    - Se meses ou anos estiverem vazios, não aplica esse filtro.
-    """
-    nome = nome_arquivo.lower().strip()
-
-    # Filtro por mês
-    if meses:
-        palavras_meses = [
-            variacao
-            for m in meses
-            for variacao in mes_numero_para_palavras(m)
-        ]
-        tem_mes = any(p in nome for p in palavras_meses)
-        if not tem_mes:
-            return False
-
-    # Filtro por ano
-    if anos:
-        tem_ano = any(str(a) in nome for a in anos)
-        if not tem_ano:
-            return False
-
-    return True
-
+if 'duplicados' not in st.session_state:
+    st.session_state.duplicados = {}
+if 'exportacao_contas' not in st.session_state:
+    st.session_state.exportacao_contas = {}
+if 'memoizacao_ativa' not in st.session_state:
+    st.session_state.memoizacao_ativa = True
+if 'artefatos' not in st.session_state:
+    st.session_state.artefatos = {}
+if 'tempos_rerun' not in st.session_state:
+    st.session_state.tempos_rerun = {'com memoização': [], 'sem memoização': []}
 
 # ==================== FUNÇÕES DE AUTENTICAÇÃO ====================
 
@@ -173,12 +163,23 @@ def salvar_tokens(access_token, refresh_token, expires_in):
         'refresh_token': refresh_token,
         'expires_at': (datetime.now() + timedelta(seconds=expires_in)).isoformat()
     }
-    with open(TOKEN_FILE, 'w') as f:
+    # Escrita atômica: workers e outras sessões leem este arquivo ao mesmo tempo
+    temporario = f"{TOKEN_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporario, 'w') as f:
         json.dump(tokens, f)
+    os.replace(temporario, TOKEN_FILE)
     st.session_state.access_token = access_token
     st.session_state.token_expiry = datetime.fromisoformat(tokens['expires_at'])
 
 
+def _ler_tokens():
+    try:
+        with open(TOKEN_FILE, 'r') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
 def carregar_tokens():
     if not os.path.exists(TOKEN_FILE):
         return None
@@ -227,14 +228,14 @@ def obter_access_token(authorization_code):
     }
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
     try:
-        response = requests.post(url, data=payload, headers=headers)
-        if response.status_code != 200:
-            st.error(f"❌ Status: {response.status_code}")
-            st.error(f"Resposta: {response.text}")
-            return None
+        response = requisitar("POST", url, classe="auth", data=payload, headers=headers)
         data = response.json()
         salvar_tokens(data['access_token'], data['refresh_token'], data['expires_in'])
         return data
+    except requests.exceptions.HTTPError as e:
+        st.error(f"❌ Status: {e.response.status_code}")
+        st.error(f"Resposta: {e.response.text}")
+        return None
     except Exception as e:
         st.error(f"❌ Erro ao obter access token: {e}")
         return None
@@ -250,18 +251,19 @@ def refresh_access_token(refresh_token):
     }
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
     try:
-        response = requests.post(url, data=payload, headers=headers)
-        if response.status_code != 200:
-            if os.path.exists(TOKEN_FILE):
-                os.remove(TOKEN_FILE)
-            st.session_state.access_token = None
-            st.session_state.token_expiry = None
-            return None
+        response = requisitar("POST", url, classe="auth", data=payload, headers=headers)
         data = response.json()
         salvar_tokens(data['access_token'], data['refresh_token'], data['expires_in'])
         return data
-    except Exception:
-        if os.path.exists(TOKEN_FILE):
+    except Exception as e:
+        atual = _ler_tokens()
+        if atual and atual.get('refresh_token') != refresh_token:
+            # Outra sessão (ou o coordenador dos workers) já renovou
+            st.session_state.access_token = atual['access_token']
+            st.session_state.token_expiry = datetime.fromisoformat(atual['expires_at'])
+            return atual
+        status = getattr(getattr(e, 'response', None), 'status_code', None)
+        if isinstance(e, requests.exceptions.HTTPError) and status in (400, 401) and atual:
             os.remove(TOKEN_FILE)
         st.session_state.access_token = None
         st.session_state.token_expiry = None
@@ -277,40 +279,29 @@ def verificar_e_renovar_token():
     return True
 
 
-def get_authorization_url():
-    return f"https://accounts.rdstation.com/oauth/authorize?response_type=code&client_id={CLIENT_ID}&redirect_uri={REDIRECT_URI}"
+def get_authorization_url(client_id=CLIENT_ID, state=None):
+    url = f"https://accounts.rdstation.com/oauth/authorize?response_type=code&client_id={client_id}&redirect_uri={REDIRECT_URI}"
+    if state:
+        url += f"&state={state}"
+    return url
 
 
 # ==================== FUNÇÕES DA API ====================
 
-def fazer_requisicao_com_retry(url, headers, params=None, max_tentativas=3):
-    for tentativa in range(max_tentativas):
-        try:
-            response = requests.get(url, headers=headers, params=params)
-            if response.status_code == 401:
-                tokens = carregar_tokens()
-                if tokens:
-                    headers["Authorization"] = f"Bearer {st.session_state.access_token}"
-                    continue
-                else:
-                    raise Exception("Não foi possível renovar o token")
-            if response.status_code == 429:
-                time.sleep((tentativa + 1) * 5)
-                continue
-            response.raise_for_status()
-            return response
-        except requests.exceptions.HTTPError as e:
-            if tentativa == max_tentativas - 1:
-                raise e
-            time.sleep(2)
-    return None
-
+def fazer_requisicao_com_retry(url, headers, params=None):
+    """GET na API do CRM via camada de resiliência (timeouts, backoff, orçamento de retries)."""
+    def renovar_token():
+        # 401: o token do arquivo foi recusado mesmo sem estar perto de expirar — renova à força
+        tokens = _ler_tokens()
+        if not tokens or not refresh_access_token(tokens['refresh_token']):
+            return None
+        # Mantém o token novo nos headers do chamador (ex.: paginação)
+        headers["Authorization"] = f"Bearer {st.session_state.access_token}"
+        return st.session_state.access_token
 
-def eh_holerite(nome_arquivo: str) -> bool:
-    nome = nome_arquivo.lower().strip()
-    if not nome.endswith('.pdf'):
-        return False
-    return any(palavra in nome for palavra in PALAVRAS_CHAVE_HOLERITE)
+    # Mesmo limitador da conta principal usado pelos painéis multi-conta, workers e prefetch
+    limitador_da_conta(CONTA_PADRAO).adquirir()
+    return requisitar("GET", url, classe="api", headers=headers, params=params, renovar_token=renovar_token)
 
 
 def buscar_organizations(token):
@@ -339,7 +330,7 @@ def buscar_organizations(token):
     return todas_orgs
 
 
-def buscar_pipelines(token):
+def buscar_pipelines(token, em_erro=[]):
     url = "https://api.rd.services/crm/v2/pipelines"
     headers = {"Authorization": f"Bearer {token}"}
     try:
@@ -348,10 +339,10 @@ def buscar_pipelines(token):
             return response.json().get('data', [])
     except Exception as e:
         st.error(f"❌ Erro ao buscar pipelines: {e}")
-    return []
+    return em_erro
 
 
-def buscar_stages(token, pipeline_id):
+def buscar_stages(token, pipeline_id, em_erro=[]):
     url = f"https://api.rd.services/crm/v2/pipelines/{pipeline_id}/stages"
     headers = {"Authorization": f"Bearer {token}"}
     try:
@@ -360,82 +351,7 @@ def buscar_stages(token, pipeline_id):
             return response.json().get('data', [])
     except Exception as e:
         st.error(f"❌ Erro ao buscar stages: {e}")
-    return []
-
-
-def _rdql_or(field, values):
-    values = [v for v in (values or []) if v]
-    if not values:
-        return None
-    if len(values) == 1:
-        return f"{field}:{values[0]}"
-    return "(" + " OR ".join(f"{field}:{v}" for v in values) + ")"
-
-
-def _rdql_and(parts):
-    parts = [p for p in (parts or []) if p]
-    if not parts:
-        return None
-    if len(parts) == 1:
-        return parts[0]
-    return " AND ".join(parts)
-
-
-def build_deals_rdql_filter(pipeline_id=None, stage_ids=None, organization_ids=None):
-    """Monta filtro RDQL apenas para campos que a API suporta sem erros."""
-    parts = []
-    if pipeline_id:
-        parts.append(f"pipeline_id:{pipeline_id}")
-    parts.append(_rdql_or("stage_id", stage_ids))
-    parts.append(_rdql_or("organization_id", organization_ids))
-    return _rdql_and(parts)
-
-
-def deal_criado_no_periodo(deal: dict, meses: list, anos: list) -> bool:
-    """
-    Filtra localmente pelo campo created_at do deal.
-    Retorna True se o deal foi criado no(s) mês(es) e ano(s) selecionados.
-    Se meses e anos estiverem vazios, aceita tudo.
-    """
-    if not meses and not anos:
-        return True
-
-    created_raw = deal.get('created_at') or deal.get('inserted_at')
-    if not created_raw:
-        # Sem data no deal, não conseguimos filtrar — inclui por segurança
-        return True
-
-    try:
-        dt = datetime.fromisoformat(created_raw.replace('Z', '+00:00'))
-        if anos and dt.year not in anos:
-            return False
-        if meses and dt.month not in meses:
-            return False
-        return True
-    except Exception:
-        return True  # se não conseguir parsear, inclui
-
-
-PRODUTOS_BLOQUEADOS = {"compra de divida", "portabilidade"}
-
-
-def nome_deal_valido(nome: str) -> bool:
-    if not nome:
-        return True
-    nome_norm = nome.strip().lower()
-    if nome_norm.startswith("port") or nome_norm.endswith("port"):
-        return False
-    return True
-
-
-def produto_deal_valido(deal: dict) -> bool:
-    produto = (
-        deal.get("product_name")
-        or deal.get("product")
-        or deal.get("custom_fields", {}).get("produto")
-        or ""
-    )
-    return produto.strip().lower() not in PRODUTOS_BLOQUEADOS
+    return em_erro
 
 
 def listar_deals(
@@ -446,10 +362,25 @@ def listar_deals(
     ignorar_processados=False,
     meses=None,
     anos=None,
+    estado=None,
 ):
     url = "https://api.rd.services/crm/v2/deals"
     headers = {"Authorization": f"Bearer {token}"}
 
+    # Estado local mantido por webhooks: nenhuma paginação na API
+    if estado and estado.sincronizado_em(CONTA_PADRAO):
+        deals_filtrados = filtrar_deals(
+            estado.deals(CONTA_PADRAO),
+            pipeline_id=pipeline_id,
+            stage_ids=stage_ids,
+            organization_ids=organization_ids,
+            meses=meses,
+            anos=anos,
+            processados=None if ignorar_processados else carregar_processados(),
+        )[:MAX_DEALS]
+        st.text(f"📡 {len(deals_filtrados)} deals encontrados no estado local")
+        return deals_filtrados
+
     # Filtro RDQL apenas com campos estáveis (sem data — filtramos data localmente)
     api_filter_full = build_deals_rdql_filter(
         pipeline_id=pipeline_id,
@@ -490,36 +421,16 @@ def listar_deals(
             if not deals_pagina:
                 break
 
-            deals_pagina_filtrada = deals_pagina
-
-            # Filtros server-side replicados localmente (segurança)
-            if pipeline_id and api_filter != f"pipeline_id:{pipeline_id}":
-                deals_pagina_filtrada = [d for d in deals_pagina_filtrada if d.get('pipeline_id') == pipeline_id]
-            if stage_ids:
-                stage_ids_set = set(stage_ids)
-                deals_pagina_filtrada = [d for d in deals_pagina_filtrada if d.get('stage_id') in stage_ids_set]
-            if organization_ids:
-                org_ids_set = set(organization_ids)
-                deals_pagina_filtrada = [
-                    d for d in deals_pagina_filtrada
-                    if d.get('organization_id') in org_ids_set and d.get('organization_id') is not None
-                ]
-
-            # Filtro local por nome/produto
-            deals_pagina_filtrada = [
-                d for d in deals_pagina_filtrada
-                if nome_deal_valido(d.get("name", "")) and produto_deal_valido(d)
-            ]
-
-            # Filtro local por data de criação do deal (created_at)
-            if meses or anos:
-                deals_pagina_filtrada = [
-                    d for d in deals_pagina_filtrada
-                    if deal_criado_no_periodo(d, meses or [], anos or [])
-                ]
-
-            if processed_deals and not ignorar_processados:
-                deals_pagina_filtrada = [d for d in deals_pagina_filtrada if d.get('id') not in processed_deals]
+            # Filtros server-side replicados localmente (segurança) + filtros locais
+            deals_pagina_filtrada = filtrar_deals(
+                deals_pagina,
+                pipeline_id=pipeline_id if api_filter != f"pipeline_id:{pipeline_id}" else None,
+                stage_ids=stage_ids,
+                organization_ids=organization_ids,
+                meses=meses,
+                anos=anos,
+                processados=None if ignorar_processados else processed_deals,
+            )
 
             deals_filtrados.extend(deals_pagina_filtrada)
 
@@ -554,94 +465,191 @@ def listar_deals(
     return deals_filtrados
 
 
-def arquivo_dentro_periodo(arquivo: dict, filtro_meses: list, filtro_anos: list) -> bool:
+def baixar_holerites_deal(token, deal_id, filtro_meses=None, filtro_anos=None, hedge=False, classificar=False,
+                          estado=None, armazem=None, coleta=None):
     """
-    Verifica se o arquivo está dentro do período selecionado.
-    Prioridade:
-      1. Campo created_at do arquivo (se existir) — mais confiável
-      2. Fallback: procura mês/ano no nome do arquivo
+    Baixa holerites de um deal, com filtro opcional por mes e ano.
+    Com `classificar=True`, baixa todos os PDFs e decide pelo conteúdo (marcadores e
+    competência da primeira página), caindo no filtro de período por data/nome
+    quando o PDF não traz a competência, e no filtro padrão por nome quando não
+    tem texto legível (scan) ou não abre.
+    Com `estado`, a lista de arquivos vem do estado local (webhooks) quando conhecida.
+    Com `armazem`, PDFs já pré-carregados (prefetch) são lidos do disco.
+    Com `coleta`, as latências dos downloads vão também para ela (resumo por execução).
     """
-    usar_meses = bool(filtro_meses)
-    usar_anos  = bool(filtro_anos)
-
-    if not usar_meses and not usar_anos:
-        return True  # sem filtro, aceita tudo
-
-    # --- Tentativa 1: usar created_at do arquivo ---
-    created_raw = arquivo.get('created_at') or arquivo.get('uploaded_at') or arquivo.get('inserted_at')
-    if created_raw:
-        try:
-            # Suporta ISO 8601 com ou sem timezone
-            dt = datetime.fromisoformat(created_raw.replace('Z', '+00:00'))
-            if usar_anos and dt.year not in filtro_anos:
-                return False
-            if usar_meses and dt.month not in filtro_meses:
-                return False
-            return True
-        except Exception:
-            pass  # cai no fallback
-
-    # --- Fallback: procurar no nome do arquivo ---
-    nome = (arquivo.get('name') or '').lower()
-    if usar_anos:
-        if not any(str(a) in nome for a in filtro_anos):
-            return False
-    if usar_meses:
-        palavras_meses = [v for m in filtro_meses for v in mes_numero_para_palavras(m)]
-        if not any(p in nome for p in palavras_meses):
-            return False
-    return True
-
-
-def baixar_holerites_deal(token, deal_id, filtro_meses=None, filtro_anos=None):
-    """Baixa holerites de um deal, com filtro opcional por mes e ano."""
     url = f"https://api.rd.services/crm/v2/deals/{deal_id}/files"
     headers = {"Authorization": f"Bearer {token}"}
 
     try:
-        response = fazer_requisicao_com_retry(url, headers)
-        if not response:
-            return []
+        arquivos = estado.arquivos_do_deal(CONTA_PADRAO, deal_id) if estado else None
+        if arquivos is None:
+            response = fazer_requisicao_com_retry(url, headers)
+            if not response:
+                return []
 
-        dados = response.json()
-        arquivos = dados.get('data', [])
+            dados = response.json()
+            arquivos = dados.get('data', [])
+            if estado:
+                estado.salvar_arquivos_deal(CONTA_PADRAO, deal_id, arquivos)
 
         holerites = []
+        origens = []
         for arquivo in arquivos:
             nome = arquivo.get('name', '')
 
-            # 1) Deve ser PDF com palavra-chave de holerite
-            if not eh_holerite(nome):
-                continue
+            if classificar:
+                # Classificação por conteúdo: qualquer PDF é candidato
+                if not nome.lower().strip().endswith('.pdf'):
+                    continue
+            else:
+                # 1) Deve ser PDF com palavra-chave de holerite
+                if not eh_holerite(nome):
+                    continue
 
-            # 2) Filtro de período: usa created_at do arquivo, ou fallback por nome
-            if not arquivo_dentro_periodo(arquivo, filtro_meses or [], filtro_anos or []):
-                continue
+                # 2) Filtro de período: usa created_at do arquivo, ou fallback por nome
+                if not arquivo_dentro_periodo(arquivo, filtro_meses or [], filtro_anos or []):
+                    continue
 
             url_arquivo = arquivo.get('url')
             try:
-                resp = requests.get(url_arquivo, stream=True)
-                resp.raise_for_status()
+                aquecido = armazem.obter(arquivo) if armazem else None
+                if aquecido:
+                    conteudo, sha256 = aquecido
+                else:
+                    conteudo, info = baixar_conteudo(url_arquivo, hedge=hedge, coleta=coleta)
+                    sha256 = info['sha256']
                 holerites.append({
                     'nome': nome,
                     'deal_id': deal_id,
-                    'conteudo': resp.content,
-                    'tamanho': len(resp.content)
+                    'conteudo': conteudo,
+                    'tamanho': len(conteudo),
+                    'sha256': sha256,
                 })
+                origens.append(arquivo)
             except Exception as e:
                 st.warning(f"Erro ao baixar {nome}: {e}")
 
+        if classificar and holerites:
+            resultados = classificacao.classificar_lote([(h['sha256'], h['conteudo']) for h in holerites])
+            selecionados = []
+            for h, arquivo in zip(holerites, origens):
+                resultado = resultados[h['sha256']]
+                if classificacao.selecionar(resultado, arquivo, filtro_meses or [], filtro_anos or []):
+                    if resultado.get('mes') is not None:
+                        h['competencia'] = (resultado['mes'], resultado['ano'])
+                    selecionados.append(h)
+            holerites = selecionados
+
         return holerites
     except Exception:
         return []
 
 
+def montar_zip(holerites, duplicados=None):
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for h in holerites:
+            zip_file.writestr(chave_arquivo(h['deal_id'], h['nome']), h['conteudo'])
+        if duplicados:
+            zip_file.writestr(
+                "manifesto_duplicados.json",
+                json.dumps(duplicados, indent=1, ensure_ascii=False)
+            )
+    return zip_buffer.getvalue()
+
+
+# ==================== MEMOIZAÇÃO DE RERUNS ====================
+
+def fingerprint_holerites(holerites, duplicados=None):
+    """Identifica o conjunto de resultados pelos sha256 — não relê o conteúdo dos PDFs."""
+    h = hashlib.sha256()
+    for x in holerites:
+        h.update(f"{x['deal_id']}|{x['nome']}|{x.get('sha256') or x['tamanho']}\n".encode())
+    if duplicados:
+        h.update(json.dumps(duplicados, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def memoizar_artefato(tipo, fingerprint, calcular):
+    """Guarda um artefato por (tipo, fingerprint) no session_state; mantém só o mais recente de cada tipo."""
+    if not st.session_state.memoizacao_ativa:
+        return calcular()
+    cache = st.session_state.artefatos
+    chave = (tipo, fingerprint)
+    if chave not in cache:
+        for antiga in [k for k in cache if k[0] == tipo]:
+            del cache[antiga]
+        cache[chave] = calcular()
+    return cache[chave]
+
+
+_NAO_CARREGADO = object()
+
+
+def buscar_pipelines_memo(token):
+    """Pipelines da sessão — só vai à API na primeira vez (ou com memoização desativada)."""
+    if not st.session_state.memoizacao_ativa:
+        return buscar_pipelines(token)
+    # Lista vazia também é resultado válido; só erros deixam de ser guardados
+    if st.session_state.get('pipelines_cache', _NAO_CARREGADO) is _NAO_CARREGADO:
+        pipelines = buscar_pipelines(token, em_erro=None)
+        if pipelines is None:
+            return []
+        st.session_state.pipelines_cache = pipelines
+    return st.session_state.pipelines_cache
+
+
+def buscar_stages_memo(token, pipeline_id):
+    """Stages por pipeline — refaz a chamada só quando o pipeline selecionado muda para um novo."""
+    if not st.session_state.memoizacao_ativa:
+        return buscar_stages(token, pipeline_id)
+    cache = st.session_state.setdefault('stages_cache', {})
+    if pipeline_id not in cache:
+        stages = buscar_stages(token, pipeline_id, em_erro=None)
+        if stages is None:
+            return []
+        cache[pipeline_id] = stages
+    return cache[pipeline_id]
+
+
+def renderizar_paginado(linhas, chave, por_pagina=50):
+    """Mostra uma lista longa em páginas, num único elemento de texto."""
+    total_paginas = max(1, math.ceil(len(linhas) / por_pagina))
+    pagina = 1
+    if total_paginas > 1:
+        pagina = st.number_input(f"Página (de {total_paginas})", min_value=1, max_value=total_paginas, value=1, key=chave)
+    inicio = (pagina - 1) * por_pagina
+    st.text("\n".join(linhas[inicio:inicio + por_pagina]))
+
+
 # ==================== INTERFACE ====================
 
 st.markdown('<div class="main-header">📄 Download de Holerites - RD Station CRM</div>', unsafe_allow_html=True)
 
+contas = carregar_contas(Conta(CONTA_PADRAO, CLIENT_ID, CLIENT_SECRET, token_file=TOKEN_FILE, processed_file=PROCESSED_FILE))
+contas_por_nome = {c.nome: c for c in contas}
+estado_local = EstadoLocal()
+
+
+def estado_para_buscas():
+    """Estado local só vale com o receptor de webhooks rodando — sem ele a lista envelhece sem aviso."""
+    if st.session_state.get('usar_estado_local') and receptor_ativo():
+        return estado_local
+    return None
+
+armazem_quente = ArmazemQuente()
+
 query_params = st.query_params
-if 'code' in query_params and not st.session_state.access_token:
+estado_oauth = query_params.get('state')
+if 'code' in query_params and estado_oauth in contas_por_nome and estado_oauth != CONTA_PADRAO:
+    # Retorno do OAuth de uma conta adicional: grava no armazém de tokens dela
+    try:
+        contas_por_nome[estado_oauth].tokens.obter_por_codigo(query_params['code'], REDIRECT_URI)
+        st.success(f"✅ Conta {estado_oauth} autorizada!")
+    except Exception as e:
+        st.error(f"❌ Erro ao autorizar conta {estado_oauth}: {e}")
+    st.query_params.clear()
+elif 'code' in query_params and not st.session_state.access_token:
     code = query_params['code']
     with st.spinner("🔄 Processando autorização automaticamente..."):
         resultado = obter_access_token(code)
@@ -667,14 +675,14 @@ with col1:
     st.header("🔎 Filtros")
 
     # ── Pipeline ──────────────────────────────────────────────
-    pipelines = buscar_pipelines(st.session_state.access_token)
+    pipelines = buscar_pipelines_memo(st.session_state.access_token)
     pipeline_map = {p.get('name', p.get('id')): p.get('id') for p in pipelines}
     pipeline_names = ["(Todos)"] + sorted(pipeline_map.keys())
     pipeline_name = st.selectbox("Pipeline", pipeline_names)
     pipeline_selected = None if pipeline_name == "(Todos)" else pipeline_map.get(pipeline_name)
 
     # ── Stage ────────────────────────────────────────────────
-    stages = buscar_stages(st.session_state.access_token, pipeline_selected) if pipeline_selected else []
+    stages = buscar_stages_memo(st.session_state.access_token, pipeline_selected) if pipeline_selected else []
     stage_map = {s.get('name', s.get('id')): s.get('id') for s in stages}
     stage_names = ["(Todos)"] + sorted(stage_map.keys())
     stage_selected_names = st.multiselect("Estágio", stage_names, default=["(Todos)"])
@@ -748,6 +756,7 @@ with col1:
             ignorar_processados=usando_filtro_data,
             meses=meses_selecionados if meses_selecionados else None,
             anos=anos_selecionados if anos_selecionados else None,
+            estado=estado_para_buscas(),
         )
         st.session_state.deals_filtrados = deals
         st.session_state.holerites_baixados = []
@@ -757,16 +766,32 @@ with col1:
         st.subheader(f"📋 {len(st.session_state.deals_filtrados)} Deals")
 
         with st.expander("Ver lista"):
-            for i, deal in enumerate(st.session_state.deals_filtrados[:20], 1):
-                st.text(f"{i}. {deal.get('name', 'Sem nome')}")
-            if len(st.session_state.deals_filtrados) > 20:
-                st.text(f"... +{len(st.session_state.deals_filtrados) - 20}")
+            renderizar_paginado(
+                [f"{i}. {deal.get('name', 'Sem nome')}" for i, deal in enumerate(st.session_state.deals_filtrados, 1)],
+                chave="pagina_deals", por_pagina=20
+            )
 
         st.divider()
 
+        usar_hedge = st.checkbox(
+            "⚡ Duplicar requisição de PDFs lentos (hedge acima do p95)",
+            value=False,
+            help="Se um PDF demorar mais que o p95 observado, uma segunda requisição é enviada e vale a que terminar primeiro"
+        )
+
+        usar_classificacao = st.checkbox(
+            "🔬 Classificar PDFs pelo conteúdo",
+            value=False,
+            disabled=not classificacao.disponivel(),
+            help="Lê a primeira página de cada PDF do deal (pypdf) para achar holerites com nomes genéricos e descartar extratos. Baixa todos os PDFs do deal."
+                 + ("" if classificacao.disponivel() else " Requer: pip install pypdf")
+        )
+
         if st.button("📥 Baixar Holerites", type="primary", use_container_width=True):
             verificar_e_renovar_token()
             st.session_state.holerites_baixados = []
+            st.session_state.duplicados = {}
+            registrar_periodo_pedido(meses_selecionados, anos_selecionados)
 
             progress_bar = st.progress(0)
             status_text = st.empty()
@@ -777,6 +802,10 @@ with col1:
             skipped_count = 0
             new_processed = set()
             seen_files = set()
+            indice_hashes = carregar_indice_hashes()
+            manifesto = carregar_manifesto()
+            hashes_execucao = {}
+            coleta_latencias = EstatisticasLatencia()
 
             for idx, deal in enumerate(st.session_state.deals_filtrados, 1):
                 status_text.text(f"📄 {idx}/{total}: {deal.get('name', 'Sem nome')}")
@@ -793,20 +822,45 @@ with col1:
                     deal.get('id'),
                     filtro_meses=meses_selecionados if meses_selecionados else None,
                     filtro_anos=anos_selecionados if anos_selecionados else None,
+                    hedge=usar_hedge,
+                    classificar=usar_classificacao,
+                    estado=estado_para_buscas(),
+                    armazem=armazem_quente,
+                    coleta=coleta_latencias,
                 )
 
                 added_any = False
                 for h in holerites:
                     nome_norm = (h.get('nome') or '').strip().lower()
-                    chave_arquivo = f"{deal_id}_{nome_norm}_{h.get('tamanho') or 0}"
-                    if chave_arquivo in seen_files:
+                    chave_vista = f"{deal_id}_{nome_norm}_{h.get('tamanho') or 0}"
+                    if chave_vista in seen_files:
+                        continue
+                    seen_files.add(chave_vista)
+
+                    # Dedup por conteúdo (SHA-256): entre deals na mesma execução e,
+                    # sem filtro de data, também entre execuções via índice persistente
+                    sha = h.get('sha256')
+                    chave = chave_arquivo(deal_id, h.get('nome'))
+                    canonico = resolver_duplicado(
+                        sha, chave, hashes_execucao, indice_hashes,
+                        entre_execucoes=not usando_filtro_data,
+                    )
+                    if canonico is not None:
+                        if canonico != chave:
+                            manifesto[chave] = {'canonico': canonico, 'sha256': sha}
+                            st.session_state.duplicados[chave] = canonico
+                        # Resolvido para o canônico: o deal também está coberto
+                        added_any = True
                         continue
-                    seen_files.add(chave_arquivo)
+                    if sha:
+                        hashes_execucao[sha] = chave
+                        indice_hashes.setdefault(sha, chave)
+
                     st.session_state.holerites_baixados.append(h)
                     added_any = True
 
-                # Só marca como processado quando não há filtro de data,
-                # para não bloquear buscas futuras por outros períodos
+                # Marca como processado (só sem filtro de data, para não bloquear buscas
+                # por outros períodos) quando os arquivos entraram ou são duplicados de um canônico
                 if added_any and deal_id and not usando_filtro_data:
                     new_processed.add(deal_id)
 
@@ -816,10 +870,24 @@ with col1:
             if new_processed:
                 processed.update(new_processed)
                 salvar_processados(processed)
-
-            status_text.text(f"✅ Concluído! Pulados (já processados): {skipped_count}")
+            salvar_indice_hashes(indice_hashes)
+            if st.session_state.duplicados:
+                salvar_manifesto(manifesto)
+
+            status_text.text(
+                f"✅ Concluído! Pulados (já processados): {skipped_count} | "
+                f"Duplicados por conteúdo: {len(st.session_state.duplicados)}"
+            )
             progress_bar.progress(100)
 
+            lat = coleta_latencias.resumo(referencia=ESTATISTICAS_DOWNLOAD)
+            if lat['arquivos']:
+                st.caption(
+                    f"⏱️ Latência por arquivo: p50 {lat['p50']:.2f}s • p95 {lat['p95']:.2f}s • "
+                    f"p99 {lat['p99']:.2f}s (sem hedge, estimado: {lat['p99_sem_hedge']:.2f}s) • "
+                    f"hedges {lat['hedges_vencedores']}/{lat['hedges']} • retomadas {lat['retomadas']}"
+                )
+
             if st.session_state.holerites_baixados:
                 st.markdown(
                     f'<div class="success-box">🎉 {len(st.session_state.holerites_baixados)} holerites baixados!</div>',
@@ -832,40 +900,261 @@ with col2:
     st.header("📊 Estatísticas")
     st.metric("Deals", len(st.session_state.deals_filtrados))
     st.metric("Holerites", len(st.session_state.holerites_baixados))
+    if st.session_state.duplicados:
+        st.metric("Duplicados (conteúdo)", len(st.session_state.duplicados))
 
     if st.session_state.holerites_baixados:
-        total_size = sum(h['tamanho'] for h in st.session_state.holerites_baixados)
+        fingerprint_resultado = fingerprint_holerites(st.session_state.holerites_baixados, st.session_state.duplicados)
+        total_size = memoizar_artefato(
+            "tamanho", fingerprint_resultado,
+            lambda: sum(h['tamanho'] for h in st.session_state.holerites_baixados)
+        )
         st.metric("Tamanho", f"{total_size / (1024*1024):.2f} MB")
 
     st.divider()
     st.caption(f"🔒 Máx. páginas: **{MAX_PAGINAS}** | Máx. deals: **{MAX_DEALS}**")
 
+    # ── Estado local (webhooks) ───────────────────────────────
+    with st.expander("📡 Estado local (webhooks)"):
+        sincronizado_em = estado_local.sincronizado_em(CONTA_PADRAO)
+        contagens = estado_local.contagens(CONTA_PADRAO)
+        if sincronizado_em:
+            st.caption(
+                f"Carga completa em {datetime.fromtimestamp(sincronizado_em).strftime('%d/%m/%Y %H:%M')} • "
+                f"{contagens['deals']} deals • {contagens['arquivos']} arquivos • {contagens['eventos']} eventos"
+            )
+        else:
+            st.caption("Sem carga completa — as buscas usam a API.")
+        st.checkbox(
+            "Usar estado local nas buscas", key="usar_estado_local",
+            disabled=not (sincronizado_em and receptor_ativo()),
+            help="Requer a carga completa e o receptor de webhooks ativo; listas de arquivos "
+                 "vindas da API são rebuscadas depois de 1 h.",
+        )
+        if st.session_state.get('usar_estado_local') and not receptor_ativo():
+            st.warning("⚠️ Receptor de webhooks parado — as buscas usam a API.")
+
+        if st.button("🔄 Carga completa dos deals", use_container_width=True):
+            verificar_e_renovar_token()
+            headers_sync = {"Authorization": f"Bearer {st.session_state.access_token}"}
+            with st.spinner("Carregando todos os deals..."):
+                total_sync = sincronizar_deals(
+                    estado_local, CONTA_PADRAO,
+                    lambda pagina: fazer_requisicao_com_retry(
+                        "https://api.rd.services/crm/v2/deals", headers_sync,
+                        {"page[number]": pagina, "page[size]": 100}
+                    ).json()
+                )
+            st.success(f"✅ {total_sync} deals no estado local")
+
+        if receptor_ativo():
+            host_receptor, porta_receptor = endereco_receptor()
+            st.caption(
+                f"🟢 Escutando em http://{host_receptor}:{porta_receptor}/webhooks/{CONTA_PADRAO} — "
+                "o RD Station precisa de uma URL pública apontando para esse endereço "
+                "(túnel ou proxy reverso). Para escutar em outra interface, defina RD_WEBHOOK_HOST."
+            )
+        elif st.button("📡 Iniciar receptor de webhooks", use_container_width=True):
+            iniciar_em_segundo_plano(
+                estado_local, PORTA_PADRAO,
+                token=os.environ.get("RD_WEBHOOK_TOKEN"),
+                processados_por_conta={CONTA_PADRAO: PROCESSED_FILE},
+                host=os.environ.get("RD_WEBHOOK_HOST", "127.0.0.1"),
+            )
+            st.rerun()
+
+    # ── Pré-carga do próximo período ──────────────────────────
+    with st.expander("🌙 Pré-carga (prefetch)"):
+        agendador_prefetch = agendador_do_processo(
+            contas_por_nome[CONTA_PADRAO], armazem_quente,
+            estado_para_buscas(),
+        )
+        periodos_previstos = prever_periodos(carregar_historico())
+        stats_armazem = armazem_quente.estatisticas()
+        st.caption(
+            f"Próximo pico: {', '.join(descrever_periodo(m, a) for m, a in periodos_previstos)} • "
+            f"armazém: {stats_armazem['arquivos']} PDFs, {stats_armazem['bytes'] / (1024*1024):.1f} MB"
+        )
+        cfg = agendador_prefetch.config
+        st.caption(
+            f"Janela: {cfg['inicio_fora_pico']}h–{cfg['fim_fora_pico']}h, fora dos dias 1–{cfg['dias_pico']} • "
+            f"orçamento por rodada: {cfg['max_bytes'] / (1024*1024):.0f} MB, {cfg['max_requisicoes']} requisições"
+        )
+
+        if agendador_prefetch.ativo():
+            st.caption("🟢 Agendador ativo")
+            if st.button("⏹️ Parar agendador", use_container_width=True):
+                agendador_prefetch.parar()
+                st.rerun()
+        elif st.button("▶️ Iniciar agendador", use_container_width=True):
+            agendador_prefetch.iniciar()
+            st.rerun()
+
+        if st.button("🌙 Pré-carregar agora", use_container_width=True):
+            with st.spinner("Pré-carregando..."):
+                agendador_prefetch.executar_uma_vez(ignorar_janela=True)
+
+        if agendador_prefetch.ultimo_relatorio:
+            r = agendador_prefetch.ultimo_relatorio
+            st.caption(
+                f"Última rodada ({r['inicio']}): {r['arquivos_baixados']} PDFs novos, {r['ja_aquecidos']} já aquecidos, "
+                f"{r['bytes'] / (1024*1024):.1f} MB, {r['requisicoes']} requisições — {r['motivo_fim']}"
+            )
+
 # ── Download ZIP ──────────────────────────────────────────────
 if st.session_state.holerites_baixados:
     st.divider()
     st.header("📦 Download")
 
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for h in st.session_state.holerites_baixados:
-            nome_seguro = "".join(c for c in h['nome'] if c.isalnum() or c in (' ', '.', '_', '-'))
-            zip_file.writestr(f"{h['deal_id']}_{nome_seguro}", h['conteudo'])
-
-    zip_buffer.seek(0)
+    zip_bytes = memoizar_artefato(
+        "zip", fingerprint_resultado,
+        lambda: montar_zip(st.session_state.holerites_baixados, st.session_state.duplicados)
+    )
 
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
         st.download_button(
             label="⬇️ Baixar Todos (ZIP)",
-            data=zip_buffer.getvalue(),
+            data=zip_bytes,
             file_name=f"holerites_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
             mime="application/zip",
             use_container_width=True
         )
 
     with st.expander(f"📋 Lista de {len(st.session_state.holerites_baixados)} arquivos"):
-        for i, h in enumerate(st.session_state.holerites_baixados, 1):
-            st.text(f"{i}. {h['nome']} ({h['tamanho']/1024:.1f} KB)")
+        renderizar_paginado(
+            [f"{i}. {h['nome']} ({h['tamanho']/1024:.1f} KB)" for i, h in enumerate(st.session_state.holerites_baixados, 1)],
+            chave="pagina_arquivos"
+        )
+
+# ── Exportação multi-conta ────────────────────────────────────
+st.divider()
+with st.expander("🏢 Exportação multi-conta"):
+    if len(contas) <= 1:
+        st.caption('ℹ️ Cadastre contas adicionais em **rd_contas.json**: {"contas": [{"nome": ..., "client_id": ..., "client_secret": ...}]}')
+    else:
+        st.caption("Exporta várias contas em paralelo, cada uma com seus tokens e limite de requisições. Usa o período selecionado acima.")
+        for conta in contas:
+            if not conta.autorizada():
+                st.markdown(f"[🔐 Autorizar conta **{conta.nome}**]({get_authorization_url(conta.client_id, state=conta.nome)})")
+
+        contas_autorizadas = [c.nome for c in contas if c.autorizada()]
+        contas_selecionadas = st.multiselect("Contas", contas_autorizadas, default=contas_autorizadas)
+        hedge_contas = st.checkbox("⚡ Hedge para PDFs lentos", value=False, key="hedge_contas")
+
+        if st.button("🚀 Exportar contas selecionadas", use_container_width=True) and contas_selecionadas:
+            agendador = AgendadorContas([contas_por_nome[n] for n in contas_selecionadas], hedge=hedge_contas)
+            resultado = {}
+            execucao = threading.Thread(
+                target=lambda: resultado.update(agendador.executar(
+                    meses=meses_selecionados or None,
+                    anos=anos_selecionados or None,
+                    max_paginas=MAX_PAGINAS,
+                    max_deals=MAX_DEALS,
+                )),
+                daemon=True,
+            )
+            execucao.start()
+
+            placeholders = {nome: (st.empty(), st.progress(0)) for nome in contas_selecionadas}
+            while True:
+                terminou = not execucao.is_alive()
+                for nome, p in agendador.progresso().items():
+                    texto, barra = placeholders[nome]
+                    fase = "✅" if p['concluida'] else ("📄" if p['listagem_concluida'] else "🔍")
+                    texto.text(
+                        f"{fase} {nome}: {p['deals_concluidos']}/{p['deals']} deals • "
+                        f"{p['holerites']} holerites • {p['bytes'] / (1024*1024):.2f} MB • "
+                        f"{p['duplicados']} duplicados • {len(p['erros'])} erros"
+                    )
+                    barra.progress(p['deals_concluidos'] / p['deals'] if p['deals'] else (1.0 if p['concluida'] else 0.0))
+                if terminou:
+                    break
+                time.sleep(0.5)
+
+            for nome, p in agendador.progresso().items():
+                for erro in p['erros'][:5]:
+                    st.warning(f"{nome} — {erro}")
+            st.session_state.exportacao_contas = resultado
+
+
+# ── Modo workers (multiprocesso) ──────────────────────────────
+with st.expander("⚙️ Modo workers (multiprocesso)"):
+    st.caption(
+        "Distribui os deals numa fila local (SQLite) e sobe vários processos para baixar e gravar "
+        "os holerites. Também disponível por linha de comando: `python workers.py executar --contas ...`"
+    )
+    contas_workers = st.multiselect(
+        "Contas", [c.nome for c in contas if c.autorizada()],
+        default=[CONTA_PADRAO] if contas_por_nome[CONTA_PADRAO].autorizada() else [],
+        key="contas_workers"
+    )
+    n_workers = st.number_input("Processos", min_value=1, max_value=32, value=min(4, os.cpu_count() or 1))
+
+    if st.button("🚀 Executar com workers", use_container_width=True) and contas_workers:
+        contas_execucao = [contas_por_nome[n] for n in contas_workers]
+        fila = FilaDeals()
+        execucao_id = fila.nova_execucao(
+            contas_execucao, meses_selecionados, anos_selecionados, n_shards=int(n_workers)
+        )
+        processos = iniciar_workers(execucao_id, int(n_workers))
+        coordenador = threading.Thread(
+            target=coordenar, args=(fila, execucao_id, contas_execucao, MAX_PAGINAS, MAX_DEALS, processos), daemon=True
+        )
+        coordenador.start()
+
+        status_workers = st.empty()
+        while any(p.poll() is None for p in processos):
+            resumo = fila.resumo(execucao_id)
+            status_workers.text(" | ".join(
+                f"{conta}: " + ", ".join(f"{estado} {n}" for estado, n in sorted(estados.items()))
+                for conta, estados in resumo.items()
+            ) or "🔍 Listando deals...")
+            time.sleep(0.5)
+        coordenador.join()
+        marcar_processados(fila, execucao_id, contas_execucao)
+
+        resultado = {}
+        for a in fila.arquivos(execucao_id):
+            with open(a['caminho'], 'rb') as f:
+                conteudo = f.read()
+            resultado.setdefault(a['conta'], []).append({
+                'nome': a['nome'], 'deal_id': a['deal_id'], 'conteudo': conteudo,
+                'tamanho': a['tamanho'], 'sha256': a['sha256'],
+            })
+        falhas = sum(estados.get('falhou', 0) for estados in fila.resumo(execucao_id).values())
+        status_workers.text(f"✅ Execução {execucao_id} concluída • {sum(len(v) for v in resultado.values())} holerites • {falhas} deals com falha")
+        st.session_state.exportacao_contas = resultado
+
+# ZIPs por conta (exportação multi-conta ou modo workers)
+for nome, holerites in st.session_state.exportacao_contas.items():
+    if not holerites:
+        continue
+    st.download_button(
+        label=f"⬇️ {nome}: {len(holerites)} holerites (ZIP)",
+        data=memoizar_artefato(f"zip_{nome}", fingerprint_holerites(holerites), lambda: montar_zip(holerites)),
+        file_name=f"holerites_{nome}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+        mime="application/zip",
+        use_container_width=True,
+        key=f"zip_conta_{nome}"
+    )
+
+# ── Desempenho dos reruns ─────────────────────────────────────
+with st.expander("⏱️ Desempenho"):
+    st.checkbox(
+        "Memoização ativa (ZIP, tamanhos, pipelines e estágios)",
+        key="memoizacao_ativa",
+        help="Desative para medir o custo de um rerun sem memoização"
+    )
+    tempos_rerun = st.session_state.tempos_rerun
+    for modo, tempos in tempos_rerun.items():
+        if tempos:
+            ordenados = sorted(tempos)
+            p95 = ordenados[min(len(ordenados) - 1, int(0.95 * len(ordenados)))]
+            st.caption(
+                f"{modo}: {len(tempos)} reruns • média {sum(tempos) / len(tempos) * 1000:.0f} ms • "
+                f"p95 {p95 * 1000:.0f} ms • último {tempos[-1] * 1000:.0f} ms"
+            )
 
 # Footer
 st.divider()
@@ -874,3 +1163,8 @@ st.markdown("""
         🔒 Tokens armazenados localmente • 🔄 Renovação automática • ⚡ Processo automático
     </div>
 """, unsafe_allow_html=True)
+
+modo_rerun = 'com memoização' if st.session_state.memoizacao_ativa else 'sem memoização'
+st.session_state.tempos_rerun[modo_rerun] = (
+    st.session_state.tempos_rerun[modo_rerun] + [time.perf_counter() - _inicio_rerun]
+)[-200:]
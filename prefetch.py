@@ -0,0 +1,356 @@
+"""
+Pré-carga (prefetch) dos holerites do próximo período de pico.
+
+No começo de cada mês todos buscam os holerites do mês anterior ao mesmo tempo.
+Este agendador prevê esse período a partir dos períodos pedidos antes, e fora
+do horário de pico baixa os deals/arquivos correspondentes para um armazém
+local, respeitando um orçamento de banda e de requisições à API. No pico,
+`baixar_holerites_deal` encontra os PDFs já no disco.
+
+    python prefetch.py --conta cliente_a            # uma rodada (respeita a janela)
+    python prefetch.py --conta cliente_a --agora    # ignora a janela fora de pico
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime
+
+from contas import carregar_contas
+from download import baixar_conteudo
+from holerites import MESES_MAP, MESES_NOMES_PT, eh_holerite, arquivo_dentro_periodo, filtrar_deals
+
+PERIODOS_FILE = "periodos_pedidos.json"
+ARMAZEM_DIR = "cache_holerites"
+
+CONFIG_PADRAO = {
+    'inicio_fora_pico': 22,                 # hora em que começa a janela fora de pico
+    'fim_fora_pico': 6,                     # hora em que termina
+    'dias_pico': 5,                         # primeiros dias do mês: não faz prefetch
+    'max_bytes': 500 * 1024 * 1024,         # orçamento de banda por rodada
+    'max_requisicoes': 2000,                # orçamento de requisições à API por rodada
+    'banda_bytes_s': 2 * 1024 * 1024,       # taxa máxima de download
+    'max_deals': 1000,
+    'periodos': 2,                          # quantos períodos prováveis aquecer
+    'intervalo_minutos': 30,                # intervalo entre verificações do agendador
+    'max_bytes_armazem': 2 * 1024 * 1024 * 1024,
+}
+
+
+# ── Histórico de períodos pedidos ─────────────────────────────
+
+def carregar_historico():
+    if not os.path.exists(PERIODOS_FILE):
+        return []
+    try:
+        with open(PERIODOS_FILE, 'r') as f:
+            data = json.load(f)
+        return data if isinstance(data, list) else []
+    except Exception:
+        return []
+
+
+def registrar_periodo_pedido(meses, anos, quando=None):
+    """Guarda o período de uma busca (para prever o próximo)."""
+    if not meses:
+        return
+    quando = quando or date.today()
+    historico = carregar_historico()
+    historico.append({'pedido_em': quando.isoformat(), 'meses': list(meses), 'anos': list(anos or [])})
+    try:
+        with open(PERIODOS_FILE, 'w') as f:
+            json.dump(historico[-500:], f)
+    except Exception:
+        pass
+
+
+def prever_periodos(historico, referencia=None, quantidade=2):
+    """
+    Períodos (mes, ano) prováveis do próximo pico (início do mês seguinte a `referencia`).
+    Aprende a defasagem "mês do pedido - mês pedido" do histórico; sem histórico, assume
+    o mês anterior ao pico (defasagem 1).
+    """
+    referencia = referencia or date.today()
+    defasagens = Counter()
+    for registro in historico:
+        try:
+            pedido = date.fromisoformat(registro['pedido_em'])
+        except (KeyError, ValueError):
+            continue
+        for mes in registro.get('meses', []):
+            if mes not in MESES_MAP:
+                continue
+            for ano in registro.get('anos') or [pedido.year]:
+                defasagem = (pedido.year * 12 + pedido.month) - (ano * 12 + mes)
+                if 0 <= defasagem <= 12:
+                    defasagens[defasagem] += 1
+    if not defasagens:
+        defasagens[1] = 1
+
+    pico = referencia.year * 12 + referencia.month  # índice do mês seguinte (base 0 + 1)
+    periodos = []
+    for defasagem, _ in defasagens.most_common(quantidade):
+        indice = pico - defasagem
+        periodos.append((indice % 12 + 1, indice // 12))
+    return periodos
+
+
+def descrever_periodo(mes, ano):
+    return f"{MESES_NOMES_PT[mes - 1]}/{ano}"
+
+
+def em_janela_fora_de_pico(agora=None, config=CONFIG_PADRAO):
+    agora = agora or datetime.now()
+    if agora.day <= config['dias_pico']:
+        return False
+    inicio, fim = config['inicio_fora_pico'], config['fim_fora_pico']
+    if inicio <= fim:
+        return inicio <= agora.hour < fim
+    return agora.hour >= inicio or agora.hour < fim
+
+
+# ── Armazém local de PDFs pré-carregados ─────────────────────
+
+class ArmazemQuente:
+    """PDFs guardados por sha256 em disco, indexados pelo id (ou URL) do arquivo no CRM."""
+
+    def __init__(self, diretorio=ARMAZEM_DIR):
+        self.diretorio = diretorio
+        self.caminho_indice = os.path.join(diretorio, "indice.json")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def chave(arquivo):
+        return str(arquivo.get('id') or arquivo.get('url'))
+
+    def _carregar_indice(self):
+        if not os.path.exists(self.caminho_indice):
+            return {}
+        try:
+            with open(self.caminho_indice, 'r') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def _salvar_indice(self, indice):
+        os.makedirs(self.diretorio, exist_ok=True)
+        tmp = self.caminho_indice + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(indice, f)
+        os.replace(tmp, self.caminho_indice)
+
+    def _caminho(self, sha256):
+        return os.path.join(self.diretorio, sha256[:2], sha256)
+
+    def contem(self, arquivo) -> bool:
+        with self._lock:
+            return self.chave(arquivo) in self._carregar_indice()
+
+    def obter(self, arquivo):
+        """(conteudo, sha256) se o arquivo está aquecido, senão None."""
+        with self._lock:
+            entrada = self._carregar_indice().get(self.chave(arquivo))
+        if not entrada:
+            return None
+        try:
+            with open(self._caminho(entrada['sha256']), 'rb') as f:
+                return f.read(), entrada['sha256']
+        except OSError:
+            return None
+
+    def guardar(self, arquivo, deal_id, conteudo, sha256):
+        caminho = self._caminho(sha256)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        if not os.path.exists(caminho):
+            with open(caminho, 'wb') as f:
+                f.write(conteudo)
+        with self._lock:
+            indice = self._carregar_indice()
+            indice[self.chave(arquivo)] = {
+                'sha256': sha256, 'tamanho': len(conteudo), 'nome': arquivo.get('name', ''),
+                'deal_id': deal_id, 'guardado_em': time.time(),
+            }
+            self._salvar_indice(indice)
+
+    def limpar(self, max_bytes):
+        """Remove os mais antigos até caber em `max_bytes`."""
+        with self._lock:
+            indice = self._carregar_indice()
+            por_sha = {}
+            for chave, e in indice.items():
+                por_sha.setdefault(e['sha256'], []).append(chave)
+            total = sum(indice[chaves[0]]['tamanho'] for chaves in por_sha.values())
+            for chave, e in sorted(indice.items(), key=lambda kv: kv[1]['guardado_em']):
+                if total <= max_bytes:
+                    break
+                if chave not in indice:
+                    continue
+                for c in por_sha.pop(e['sha256'], []):
+                    indice.pop(c, None)
+                if os.path.exists(self._caminho(e['sha256'])):
+                    os.remove(self._caminho(e['sha256']))
+                total -= e['tamanho']
+            self._salvar_indice(indice)
+
+    def estatisticas(self):
+        with self._lock:
+            indice = self._carregar_indice()
+        shas = {e['sha256']: e['tamanho'] for e in indice.values()}
+        return {'arquivos': len(indice), 'bytes': sum(shas.values())}
+
+
+# ── Agendador ────────────────────────────────────────────────
+
+class OrcamentoEsgotado(Exception):
+    pass
+
+
+class AgendadorPrefetch:
+    """
+    Aquece o armazém para os períodos previstos. Fonte dos deals: o estado local
+    dos webhooks (se já tem carga completa) ou a listagem da API da conta.
+    """
+
+    def __init__(self, conta, armazem=None, estado=None, config=None):
+        self.conta = conta
+        self.armazem = armazem or ArmazemQuente()
+        self.estado = estado
+        self.config = dict(CONFIG_PADRAO, **(config or {}))
+        self.ultimo_relatorio = None
+        self._thread = None
+        self._parar = threading.Event()
+
+    def _deals_do_periodo(self, meses, anos, gastar_requisicao):
+        if self.estado and self.estado.sincronizado_em(self.conta.nome):
+            return filtrar_deals(self.estado.deals(self.conta.nome), meses=meses, anos=anos)[:self.config['max_deals']]
+        # O filtro de período é local: cobra cada página lida, não os deals que sobraram
+        return list(self.conta.listar_deals(meses, anos, ignorar_processados=True,
+                                            max_paginas=100, max_deals=self.config['max_deals'],
+                                            antes_da_pagina=lambda: gastar_requisicao(1)))
+
+    def _arquivos_do_deal(self, deal_id, gastar_requisicao):
+        if self.estado:
+            arquivos = self.estado.arquivos_do_deal(self.conta.nome, deal_id)
+            if arquivos is not None:
+                return arquivos
+        gastar_requisicao(1)
+        arquivos = self.conta.get(f"https://api.rd.services/crm/v2/deals/{deal_id}/files").json().get('data', [])
+        if self.estado:
+            self.estado.salvar_arquivos_deal(self.conta.nome, deal_id, arquivos)
+        return arquivos
+
+    def executar_uma_vez(self, ignorar_janela=False):
+        """Uma rodada de prefetch. Retorna o relatório (também em `ultimo_relatorio`)."""
+        config = self.config
+        periodos = prever_periodos(carregar_historico(), quantidade=config['periodos'])
+        relatorio = {
+            'inicio': datetime.now().isoformat(timespec='seconds'),
+            'periodos': [descrever_periodo(m, a) for m, a in periodos],
+            'deals': 0, 'arquivos_baixados': 0, 'ja_aquecidos': 0,
+            'bytes': 0, 'requisicoes': 0, 'motivo_fim': 'concluído',
+        }
+        if not ignorar_janela and not em_janela_fora_de_pico(config=config):
+            relatorio['motivo_fim'] = 'fora da janela fora de pico'
+            self.ultimo_relatorio = relatorio
+            return relatorio
+
+        def gastar_requisicao(n):
+            if relatorio['requisicoes'] + n > config['max_requisicoes']:
+                raise OrcamentoEsgotado('orçamento de requisições esgotado')
+            relatorio['requisicoes'] += n
+
+        try:
+            for mes, ano in periodos:
+                for deal in self._deals_do_periodo([mes], [ano], gastar_requisicao):
+                    if self._parar.is_set():
+                        raise OrcamentoEsgotado('interrompido')
+                    relatorio['deals'] += 1
+                    deal_id = deal.get('id')
+                    for arquivo in self._arquivos_do_deal(deal_id, gastar_requisicao):
+                        nome = arquivo.get('name', '')
+                        if not eh_holerite(nome) or not arquivo_dentro_periodo(arquivo, [mes], [ano]):
+                            continue
+                        if self.armazem.contem(arquivo):
+                            relatorio['ja_aquecidos'] += 1
+                            continue
+                        tamanho_previsto = arquivo.get('size') or 0
+                        if relatorio['bytes'] + tamanho_previsto > config['max_bytes']:
+                            raise OrcamentoEsgotado('orçamento de banda esgotado')
+                        inicio = time.monotonic()
+                        conteudo, info = baixar_conteudo(arquivo.get('url'))
+                        self.armazem.guardar(arquivo, deal_id, conteudo, info['sha256'])
+                        relatorio['arquivos_baixados'] += 1
+                        relatorio['bytes'] += len(conteudo)
+                        # Limita a taxa média de download
+                        espera = len(conteudo) / config['banda_bytes_s'] - (time.monotonic() - inicio)
+                        if espera > 0:
+                            time.sleep(espera)
+                        if relatorio['bytes'] >= config['max_bytes']:
+                            raise OrcamentoEsgotado('orçamento de banda esgotado')
+        except OrcamentoEsgotado as e:
+            relatorio['motivo_fim'] = str(e)
+        except Exception as e:
+            relatorio['motivo_fim'] = f"erro: {e}"
+
+        self.armazem.limpar(config['max_bytes_armazem'])
+        relatorio['fim'] = datetime.now().isoformat(timespec='seconds')
+        self.ultimo_relatorio = relatorio
+        return relatorio
+
+    def _loop(self):
+        while not self._parar.is_set():
+            if em_janela_fora_de_pico(config=self.config):
+                self.executar_uma_vez()
+            self._parar.wait(self.config['intervalo_minutos'] * 60)
+
+    def iniciar(self):
+        """Roda o agendador numa thread daemon (verifica a janela a cada intervalo)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._parar.clear()
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+
+    def ativo(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+
+_agendador_do_processo = None
+_agendador_lock = threading.Lock()
+
+
+def agendador_do_processo(conta, armazem=None, estado=None, config=None):
+    """Um agendador por processo (o app Streamlit reexecuta o script a cada interação)."""
+    global _agendador_do_processo
+    with _agendador_lock:
+        if _agendador_do_processo is None:
+            _agendador_do_processo = AgendadorPrefetch(conta, armazem, estado, config)
+        return _agendador_do_processo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pré-carga dos holerites do próximo período")
+    parser.add_argument("--conta", required=True, help="conta de rd_contas.json")
+    parser.add_argument("--agora", action="store_true", help="ignora a janela fora de pico")
+    parser.add_argument("--max-mb", type=float, default=CONFIG_PADRAO['max_bytes'] / (1024 * 1024))
+    parser.add_argument("--max-requisicoes", type=int, default=CONFIG_PADRAO['max_requisicoes'])
+    args = parser.parse_args(argv)
+
+    contas = {c.nome: c for c in carregar_contas()}
+    if args.conta not in contas:
+        parser.error(f"conta {args.conta} não encontrada em rd_contas.json")
+    agendador = AgendadorPrefetch(contas[args.conta], config={
+        'max_bytes': int(args.max_mb * 1024 * 1024),
+        'max_requisicoes': args.max_requisicoes,
+    })
+    print(json.dumps(agendador.executar_uma_vez(ignorar_janela=args.agora), ensure_ascii=False, indent=1))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
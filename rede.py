@@ -0,0 +1,190 @@
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+import urllib3
+
+# Timeouts (conexão, leitura) em segundos — nenhuma chamada fica sem timeout
+TIMEOUT_API = (5, 30)
+TIMEOUT_ARQUIVO = (5, 60)
+
+# Backoff exponencial com jitter ("full jitter")
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+STATUS_RETENTAVEIS = {429, 500, 502, 503, 504}
+
+# Classes de endpoint: tentativas por chamada e orçamento de retries
+#   razao   -> fração de requisições que pode virar retry
+#   minimo  -> retries sempre disponíveis (baixo tráfego)
+#   idempotente -> False: falha de rede só é retentada se foi na conexão (a requisição
+#                  não chegou ao servidor) — um refresh token pode já ter sido trocado
+CLASSES_ENDPOINT = {
+    "auth":    {"tentativas": 2, "razao": 0.1, "minimo": 3,  "timeout": TIMEOUT_API, "idempotente": False},
+    "api":     {"tentativas": 4, "razao": 0.2, "minimo": 10, "timeout": TIMEOUT_API, "idempotente": True},
+    "arquivo": {"tentativas": 3, "razao": 0.2, "minimo": 10, "timeout": TIMEOUT_ARQUIVO, "idempotente": True},
+}
+
+# Disjuntor do host de arquivos
+DISJUNTOR_LIMITE_FALHAS = 5
+DISJUNTOR_TEMPO_ABERTO = 30.0
+
+
+class CircuitoAberto(Exception):
+    """O host está com o disjuntor aberto — a requisição nem é enviada."""
+
+
+class OrcamentoRetry:
+    """
+    Orçamento de retries por classe de endpoint: cada requisição deposita
+    `razao` créditos e cada retry consome 1. Evita tempestade de retries
+    quando o serviço está degradado.
+    """
+
+    def __init__(self, razao, minimo):
+        self.razao = razao
+        self.minimo = minimo
+        self.creditos = float(minimo)
+        self._lock = threading.Lock()
+
+    def registrar_requisicao(self):
+        with self._lock:
+            self.creditos = min(self.creditos + self.razao, self.minimo + 100 * self.razao)
+
+    def consumir_retry(self) -> bool:
+        with self._lock:
+            if self.creditos >= 1:
+                self.creditos -= 1
+                return True
+            return False
+
+
+class Disjuntor:
+    """Circuit breaker simples: fechado -> aberto após N falhas -> meio-aberto após o tempo."""
+
+    def __init__(self, limite_falhas=DISJUNTOR_LIMITE_FALHAS, tempo_aberto=DISJUNTOR_TEMPO_ABERTO):
+        self.limite_falhas = limite_falhas
+        self.tempo_aberto = tempo_aberto
+        self.falhas = 0
+        self.aberto_desde = None
+        self._lock = threading.Lock()
+
+    def permitir(self) -> bool:
+        with self._lock:
+            if self.aberto_desde is None:
+                return True
+            # Meio-aberto: deixa passar uma tentativa depois do tempo de espera
+            if time.monotonic() - self.aberto_desde >= self.tempo_aberto:
+                self.aberto_desde = time.monotonic()
+                return True
+            return False
+
+    def sucesso(self):
+        with self._lock:
+            self.falhas = 0
+            self.aberto_desde = None
+
+    def falha(self):
+        with self._lock:
+            self.falhas += 1
+            if self.falhas >= self.limite_falhas:
+                self.aberto_desde = time.monotonic()
+
+
+ORCAMENTOS = {
+    classe: OrcamentoRetry(cfg["razao"], cfg["minimo"])
+    for classe, cfg in CLASSES_ENDPOINT.items()
+}
+_disjuntores = {}
+_disjuntores_lock = threading.Lock()
+
+
+def disjuntor_do_host(url) -> Disjuntor:
+    host = urlparse(url).netloc
+    with _disjuntores_lock:
+        if host not in _disjuntores:
+            _disjuntores[host] = Disjuntor()
+        return _disjuntores[host]
+
+
+def calcular_backoff(tentativa, retry_after=None) -> float:
+    """Espera antes da próxima tentativa: respeita Retry-After, senão full jitter."""
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** tentativa)))
+
+
+def falha_na_conexao(erro) -> bool:
+    """True se a requisição falhou antes de ser enviada (timeout de conexão, conexão recusada, DNS)."""
+    if isinstance(erro, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(erro, requests.exceptions.ConnectionError):
+        causa = erro.args[0] if erro.args else None
+        causa = getattr(causa, 'reason', causa)
+        return isinstance(causa, urllib3.exceptions.NewConnectionError)
+    return False
+
+
+def requisitar(metodo, url, classe="api", headers=None, renovar_token=None, **kwargs):
+    """
+    Faz uma requisição HTTP com timeout, retries com backoff exponencial e jitter,
+    orçamento de retries por classe de endpoint e disjuntor para o host de arquivos.
+
+    - `renovar_token`: callable que devolve um novo access token (ou None). É usado
+      no máximo uma vez por chamada em caso de 401.
+    - Erros 4xx (exceto 401/429) são levantados imediatamente como HTTPError.
+    - Classes não idempotentes (auth) só retentam falha de rede se foi na conexão.
+    """
+    cfg = CLASSES_ENDPOINT[classe]
+    orcamento = ORCAMENTOS[classe]
+    disjuntor = disjuntor_do_host(url) if classe == "arquivo" else None
+    kwargs.setdefault("timeout", cfg["timeout"])
+    headers = dict(headers or {})
+    token_renovado = False
+
+    orcamento.registrar_requisicao()
+    tentativa = 0
+    while True:
+        if disjuntor and not disjuntor.permitir():
+            raise CircuitoAberto(f"Disjuntor aberto para {urlparse(url).netloc}")
+
+        retry_after = None
+        try:
+            response = requests.request(metodo, url, headers=headers, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if disjuntor:
+                disjuntor.falha()
+            if not cfg["idempotente"] and not falha_na_conexao(e):
+                raise  # pode ter sido processada (ex.: timeout de leitura): não reenvia
+            erro = e
+        else:
+            if response.status_code == 401 and renovar_token and not token_renovado:
+                token_renovado = True
+                novo_token = renovar_token()
+                if not novo_token:
+                    raise Exception("Não foi possível renovar o token")
+                headers["Authorization"] = f"Bearer {novo_token}"
+                continue
+
+            if response.status_code not in STATUS_RETENTAVEIS:
+                if disjuntor:
+                    disjuntor.sucesso()
+                response.raise_for_status()
+                return response
+
+            if disjuntor and response.status_code >= 500:
+                disjuntor.falha()
+            retry_after = response.headers.get("Retry-After")
+            erro = requests.exceptions.HTTPError(
+                f"{response.status_code} para {url}", response=response
+            )
+
+        tentativa += 1
+        if tentativa >= cfg["tentativas"] or not orcamento.consumir_retry():
+            raise erro
+        time.sleep(calcular_backoff(tentativa, retry_after))
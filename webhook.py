@@ -0,0 +1,439 @@
+"""
+Receptor local de webhooks do RD Station CRM: mantém o estado de deals e de
+metadados de arquivos (o que `listar_deals` e `baixar_holerites_deal` leem)
+atualizado por push, sem paginar /crm/v2/deals a cada busca.
+
+    python webhook.py servir --porta 8765 --token SEGREDO
+    python webhook.py replay eventos.jsonl --url http://localhost:8765/webhooks/principal --token SEGREDO
+    python webhook.py replay eventos.jsonl            # aplica direto no estado local, sem HTTP
+    python webhook.py verificar                       # replay de um JSONL de exemplo contra um receptor local
+
+Eventos aceitos (JSON): {"event_name": "crm_deal_updated", "event_id": "...", "document": {...}}
+— também aceita "event_type"/"type" e "data"/"entity". Eventos de deal e de
+arquivo/anexo com create/update fazem upsert; delete/remove apagam.
+"""
+import argparse
+import hmac
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ESTADO_DB = "estado_local.db"
+PORTA_PADRAO = 8765
+# Listas de arquivos carregadas da API valem por este tempo; depois voltam a ser buscadas
+# (eventos de arquivo que chegam por webhook continuam atualizando a lista nesse intervalo)
+TTL_ARQUIVOS_SEGUNDOS = 3600
+
+
+class EstadoLocal:
+    """Deals e metadados de arquivos por conta, em SQLite, atualizados por webhook."""
+
+    def __init__(self, caminho=ESTADO_DB):
+        self.caminho = caminho
+        with self._conectar() as con:
+            con.executescript("""
+                CREATE TABLE IF NOT EXISTS deals (
+                    conta TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    dados TEXT NOT NULL,
+                    atualizado_em TEXT,
+                    PRIMARY KEY (conta, id)
+                );
+                CREATE TABLE IF NOT EXISTS arquivos (
+                    conta TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    deal_id TEXT NOT NULL,
+                    dados TEXT NOT NULL,
+                    atualizado_em TEXT,
+                    PRIMARY KEY (conta, id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_arquivos_deal ON arquivos (conta, deal_id);
+                CREATE TABLE IF NOT EXISTS deals_com_arquivos (
+                    conta TEXT NOT NULL,
+                    deal_id TEXT NOT NULL,
+                    carregado_em REAL,
+                    PRIMARY KEY (conta, deal_id)
+                );
+                CREATE TABLE IF NOT EXISTS eventos (
+                    conta TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    recebido_em REAL NOT NULL,
+                    PRIMARY KEY (conta, id)
+                );
+                CREATE TABLE IF NOT EXISTS sincronizacoes (
+                    conta TEXT PRIMARY KEY,
+                    sincronizado_em REAL NOT NULL
+                );
+            """)
+            colunas = {r['name'] for r in con.execute("PRAGMA table_info(deals_com_arquivos)")}
+            if 'carregado_em' not in colunas:
+                con.execute("ALTER TABLE deals_com_arquivos ADD COLUMN carregado_em REAL")
+
+    def _conectar(self):
+        con = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.row_factory = sqlite3.Row
+        return con
+
+    # ── Deals ────────────────────────────────────────────────
+
+    def salvar_deal(self, conta, deal) -> bool:
+        """Upsert ignorando versões mais antigas (por updated_at) que cheguem fora de ordem."""
+        atualizado_em = deal.get('updated_at')
+        with self._conectar() as con:
+            cur = con.execute(
+                "INSERT INTO deals (conta, id, dados, atualizado_em) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (conta, id) DO UPDATE SET dados = excluded.dados, atualizado_em = excluded.atualizado_em "
+                "WHERE deals.atualizado_em IS NULL OR excluded.atualizado_em IS NULL "
+                "OR excluded.atualizado_em >= deals.atualizado_em",
+                (conta, str(deal['id']), json.dumps(deal), atualizado_em)
+            )
+            return cur.rowcount == 1
+
+    def remover_deal(self, conta, deal_id):
+        with self._conectar() as con:
+            con.execute("DELETE FROM deals WHERE conta = ? AND id = ?", (conta, str(deal_id)))
+            con.execute("DELETE FROM arquivos WHERE conta = ? AND deal_id = ?", (conta, str(deal_id)))
+            con.execute("DELETE FROM deals_com_arquivos WHERE conta = ? AND deal_id = ?", (conta, str(deal_id)))
+
+    def deals(self, conta):
+        with self._conectar() as con:
+            rows = con.execute("SELECT dados FROM deals WHERE conta = ? ORDER BY id", (conta,)).fetchall()
+        return [json.loads(r['dados']) for r in rows]
+
+    def marcar_sincronizado(self, conta):
+        with self._conectar() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO sincronizacoes (conta, sincronizado_em) VALUES (?, ?)", (conta, time.time())
+            )
+
+    def sincronizado_em(self, conta):
+        """Momento da última carga completa (float) ou None — sem ela o estado local não é usado."""
+        with self._conectar() as con:
+            row = con.execute("SELECT sincronizado_em FROM sincronizacoes WHERE conta = ?", (conta,)).fetchone()
+        return row['sincronizado_em'] if row else None
+
+    # ── Arquivos ─────────────────────────────────────────────
+
+    def salvar_arquivo(self, conta, deal_id, arquivo) -> bool:
+        with self._conectar() as con:
+            cur = con.execute(
+                "INSERT INTO arquivos (conta, id, deal_id, dados, atualizado_em) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (conta, id) DO UPDATE SET deal_id = excluded.deal_id, dados = excluded.dados, "
+                "atualizado_em = excluded.atualizado_em "
+                "WHERE arquivos.atualizado_em IS NULL OR excluded.atualizado_em IS NULL "
+                "OR excluded.atualizado_em >= arquivos.atualizado_em",
+                (conta, str(arquivo['id']), str(deal_id), json.dumps(arquivo),
+                 arquivo.get('updated_at') or arquivo.get('created_at'))
+            )
+            return cur.rowcount == 1
+
+    def remover_arquivo(self, conta, arquivo_id):
+        with self._conectar() as con:
+            con.execute("DELETE FROM arquivos WHERE conta = ? AND id = ?", (conta, str(arquivo_id)))
+
+    def salvar_arquivos_deal(self, conta, deal_id, arquivos):
+        """Lista completa de arquivos de um deal (ex.: vinda da API) — daqui em diante os webhooks a mantêm."""
+        with self._conectar() as con:
+            con.execute("DELETE FROM arquivos WHERE conta = ? AND deal_id = ?", (conta, str(deal_id)))
+            con.execute(
+                "INSERT OR REPLACE INTO deals_com_arquivos (conta, deal_id, carregado_em) VALUES (?, ?, ?)",
+                (conta, str(deal_id), time.time())
+            )
+        for arquivo in arquivos:
+            if arquivo.get('id'):
+                self.salvar_arquivo(conta, deal_id, arquivo)
+
+    def arquivos_do_deal(self, conta, deal_id, ttl=TTL_ARQUIVOS_SEGUNDOS):
+        """Metadados dos arquivos do deal, ou None se a lista nunca foi carregada ou passou do `ttl`."""
+        with self._conectar() as con:
+            conhecido = con.execute(
+                "SELECT carregado_em FROM deals_com_arquivos WHERE conta = ? AND deal_id = ?", (conta, str(deal_id))
+            ).fetchone()
+            if not conhecido or conhecido['carregado_em'] is None:
+                return None
+            if ttl is not None and time.time() - conhecido['carregado_em'] > ttl:
+                return None
+            rows = con.execute(
+                "SELECT dados FROM arquivos WHERE conta = ? AND deal_id = ? ORDER BY id", (conta, str(deal_id))
+            ).fetchall()
+        return [json.loads(r['dados']) for r in rows]
+
+    # ── Eventos ──────────────────────────────────────────────
+
+    def registrar_evento(self, conta, evento_id) -> bool:
+        """False se o evento já foi aplicado (entregas repetidas do webhook)."""
+        if not evento_id:
+            return True
+        with self._conectar() as con:
+            cur = con.execute(
+                "INSERT OR IGNORE INTO eventos (conta, id, recebido_em) VALUES (?, ?, ?)",
+                (conta, str(evento_id), time.time())
+            )
+            return cur.rowcount == 1
+
+    def contagens(self, conta):
+        with self._conectar() as con:
+            deals = con.execute("SELECT COUNT(*) AS n FROM deals WHERE conta = ?", (conta,)).fetchone()['n']
+            arquivos = con.execute("SELECT COUNT(*) AS n FROM arquivos WHERE conta = ?", (conta,)).fetchone()['n']
+            eventos = con.execute("SELECT COUNT(*) AS n FROM eventos WHERE conta = ?", (conta,)).fetchone()['n']
+        return {'deals': deals, 'arquivos': arquivos, 'eventos': eventos}
+
+
+def _desmarcar_processado(processed_file, deal_id):
+    """Deal que ganhou arquivo novo volta a ser exportável na próxima busca sem filtro de data."""
+    if not processed_file or not os.path.exists(processed_file):
+        return
+    try:
+        with open(processed_file, 'r') as f:
+            processados = set(json.load(f) or [])
+        if deal_id in processados:
+            processados.discard(deal_id)
+            with open(processed_file, 'w') as f:
+                json.dump(sorted(processados), f)
+    except Exception:
+        pass
+
+
+def evento_valido(payload) -> bool:
+    """Evento no formato esperado: objeto JSON cujo documento (se houver) também é objeto."""
+    if not isinstance(payload, dict):
+        return False
+    dados = payload.get('document') or payload.get('data') or payload.get('entity') or {}
+    return isinstance(dados, dict)
+
+
+def aplicar_evento(estado, conta, payload, processed_file=None):
+    """Aplica um evento de webhook ao estado local. Retorna uma descrição curta do que fez."""
+    if not evento_valido(payload):
+        return "ignorado: evento inválido"
+    evento = str(payload.get('event_name') or payload.get('event_type') or payload.get('type') or '').lower()
+    dados = payload.get('document') or payload.get('data') or payload.get('entity') or {}
+    if not evento or not dados.get('id'):
+        return "ignorado: sem tipo ou id"
+    if not estado.registrar_evento(conta, payload.get('event_id') or payload.get('id')):
+        return "ignorado: evento repetido"
+
+    remocao = any(p in evento for p in ("delet", "remov", "destroy"))
+    if "file" in evento or "attachment" in evento or "arquivo" in evento:
+        deal_id = dados.get('deal_id') or (dados.get('deal') or {}).get('id')
+        if remocao:
+            estado.remover_arquivo(conta, dados['id'])
+            return f"arquivo {dados['id']} removido"
+        if not deal_id:
+            return "ignorado: arquivo sem deal_id"
+        if not estado.salvar_arquivo(conta, deal_id, dados):
+            return f"ignorado: versão antiga do arquivo {dados['id']}"
+        _desmarcar_processado(processed_file, deal_id)
+        return f"arquivo {dados['id']} do deal {deal_id} atualizado"
+    if "deal" in evento:
+        if remocao:
+            estado.remover_deal(conta, dados['id'])
+            return f"deal {dados['id']} removido"
+        if not estado.salvar_deal(conta, dados):
+            return f"ignorado: versão antiga do deal {dados['id']}"
+        return f"deal {dados['id']} atualizado"
+    return f"ignorado: evento {evento}"
+
+
+def sincronizar_deals(estado, conta, obter_pagina, max_paginas=1000):
+    """
+    Carga completa inicial: pagina todos os deals uma vez e grava no estado local.
+    `obter_pagina(pagina)` devolve o JSON de uma página de /crm/v2/deals.
+    """
+    total = 0
+    for pagina in range(1, max_paginas + 1):
+        dados = obter_pagina(pagina)
+        deals = dados.get('data', [])
+        for deal in deals:
+            estado.salvar_deal(conta, deal)
+        total += len(deals)
+        if not deals or not dados.get('links', {}).get('next'):
+            break
+    estado.marcar_sincronizado(conta)
+    return total
+
+
+def criar_servidor(estado, porta=PORTA_PADRAO, token=None, processados_por_conta=None, host="127.0.0.1"):
+    """Servidor HTTP em POST /webhooks/<conta>. Com `token`, exige o header X-Webhook-Token."""
+    processados_por_conta = processados_por_conta or {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+        def _responder(self, status, corpo):
+            dados = json.dumps(corpo).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def do_POST(self):
+            partes = self.path.strip('/').split('/')
+            if len(partes) != 2 or partes[0] != 'webhooks':
+                return self._responder(404, {'erro': 'use POST /webhooks/<conta>'})
+            if token and not hmac.compare_digest(self.headers.get('X-Webhook-Token', ''), token):
+                return self._responder(401, {'erro': 'token inválido'})
+            try:
+                tamanho = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(tamanho) or b'{}')
+            except ValueError:
+                return self._responder(400, {'erro': 'JSON inválido'})
+            conta = partes[1]
+            eventos = payload if isinstance(payload, list) else [payload]
+            if not eventos or not all(evento_valido(e) for e in eventos):
+                return self._responder(400, {'erro': 'esperado um evento (objeto JSON) ou uma lista de eventos'})
+            try:
+                resultados = [aplicar_evento(estado, conta, e, processados_por_conta.get(conta)) for e in eventos]
+            except Exception as e:
+                return self._responder(500, {'erro': str(e)[:200]})
+            self._responder(200, {'resultados': resultados})
+
+    return ThreadingHTTPServer((host, porta), Handler)
+
+
+_servidor_em_segundo_plano = None
+_servidor_lock = threading.Lock()
+
+
+def iniciar_em_segundo_plano(estado, porta=PORTA_PADRAO, token=None, processados_por_conta=None, host="127.0.0.1"):
+    """Sobe o receptor numa thread daemon (usado pelo app Streamlit) — uma vez por processo."""
+    global _servidor_em_segundo_plano
+    with _servidor_lock:
+        if _servidor_em_segundo_plano is None:
+            _servidor_em_segundo_plano = criar_servidor(estado, porta, token, processados_por_conta, host=host)
+            threading.Thread(target=_servidor_em_segundo_plano.serve_forever, daemon=True).start()
+        return _servidor_em_segundo_plano
+
+
+def receptor_ativo() -> bool:
+    return _servidor_em_segundo_plano is not None
+
+
+def endereco_receptor():
+    """(host, porta) em que o receptor do processo escuta, ou None."""
+    return _servidor_em_segundo_plano.server_address[:2] if _servidor_em_segundo_plano else None
+
+
+def replay(caminho_eventos, url=None, token=None, conta="principal", estado=None, processed_file=None):
+    """Reenvia eventos gravados (JSONL) para o receptor, ou aplica direto no estado se `url` for None."""
+    aplicados = []
+    with open(caminho_eventos, 'r') as f:
+        for linha in f:
+            linha = linha.strip()
+            if not linha:
+                continue
+            evento = json.loads(linha)
+            if url:
+                headers = {'X-Webhook-Token': token} if token else {}
+                resp = requests.post(url, json=evento, headers=headers, timeout=(5, 30))
+                resp.raise_for_status()
+                aplicados.extend(resp.json().get('resultados', []))
+            else:
+                aplicados.append(aplicar_evento(estado or EstadoLocal(), conta, evento, processed_file))
+    return aplicados
+
+
+def verificar_replay():
+    """
+    Replay de um JSONL de exemplo contra um receptor local (porta livre, estado temporário),
+    fazendo as vezes do RD Station: entrega repetida, evento fora de ordem, arquivo novo
+    desmarcando o deal processado e payload inválido. Levanta AssertionError se algo divergir.
+    """
+    eventos = [
+        {"event_name": "crm_deal_updated", "event_id": "e1",
+         "document": {"id": "d1", "name": "Fulano v2", "updated_at": "2025-01-02T10:00:00Z"}},
+        {"event_name": "crm_deal_updated", "event_id": "e1",
+         "document": {"id": "d1", "name": "Fulano v2", "updated_at": "2025-01-02T10:00:00Z"}},
+        {"event_name": "crm_deal_updated", "event_id": "e2",
+         "document": {"id": "d1", "name": "Fulano v1", "updated_at": "2025-01-01T10:00:00Z"}},
+        {"event_name": "crm_deal_file_created", "event_id": "e3",
+         "document": {"id": "f1", "deal_id": "d1", "name": "holerite janeiro.pdf",
+                      "created_at": "2025-01-03T10:00:00Z"}},
+    ]
+    with tempfile.TemporaryDirectory() as diretorio:
+        caminho_eventos = os.path.join(diretorio, "eventos.jsonl")
+        with open(caminho_eventos, 'w') as f:
+            f.writelines(json.dumps(e) + "\n" for e in eventos)
+        processed_file = os.path.join(diretorio, "processed_leads.json")
+        with open(processed_file, 'w') as f:
+            json.dump(["d1", "d2"], f)
+
+        estado = EstadoLocal(os.path.join(diretorio, "estado.db"))
+        servidor = criar_servidor(estado, porta=0, token="segredo", processados_por_conta={"teste": processed_file})
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{servidor.server_address[1]}/webhooks/teste"
+        try:
+            resultados = replay(caminho_eventos, url, "segredo")
+            assert resultados == [
+                "deal d1 atualizado",
+                "ignorado: evento repetido",
+                "ignorado: versão antiga do deal d1",
+                "arquivo f1 do deal d1 atualizado",
+            ], resultados
+            assert [d['name'] for d in estado.deals("teste")] == ["Fulano v2"]
+            assert estado.contagens("teste")['arquivos'] == 1
+            with open(processed_file) as f:
+                assert json.load(f) == ["d2"]
+
+            for invalido in (b'42', b'"texto"', b'[1, 2]', b'{"event_name": "crm_deal_updated", "document": "x"}'):
+                resp = requests.post(url, data=invalido, headers={'X-Webhook-Token': 'segredo'}, timeout=(5, 30))
+                assert resp.status_code == 400, (invalido, resp.status_code)
+            resp = requests.post(url, json=eventos[0], headers={'X-Webhook-Token': 'errado'}, timeout=(5, 30))
+            assert resp.status_code == 401
+        finally:
+            servidor.shutdown()
+            servidor.server_close()
+    return len(eventos)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Webhooks do RD Station CRM -> estado local")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_servir = sub.add_parser("servir", help="sobe o receptor de webhooks")
+    p_servir.add_argument("--porta", type=int, default=PORTA_PADRAO)
+    p_servir.add_argument("--host", default="127.0.0.1")
+    p_servir.add_argument("--token", default=os.environ.get("RD_WEBHOOK_TOKEN"))
+    p_servir.add_argument("--estado", default=ESTADO_DB)
+    p_servir.add_argument("--processed-file", default="processed_leads.json",
+                          help="processados da conta 'principal'")
+
+    p_replay = sub.add_parser("replay", help="reenvia eventos gravados (JSONL)")
+    p_replay.add_argument("eventos")
+    p_replay.add_argument("--url")
+    p_replay.add_argument("--token", default=os.environ.get("RD_WEBHOOK_TOKEN"))
+    p_replay.add_argument("--conta", default="principal")
+    p_replay.add_argument("--estado", default=ESTADO_DB)
+
+    sub.add_parser("verificar", help="replay de eventos de exemplo contra um receptor local")
+
+    args = parser.parse_args(argv)
+    if args.comando == "verificar":
+        print(f"ok: {verificar_replay()} eventos reproduzidos")
+        return 0
+    if args.comando == "servir":
+        servidor = criar_servidor(
+            EstadoLocal(args.estado), args.porta, args.token,
+            {"principal": args.processed_file}, host=args.host
+        )
+        print(f"recebendo webhooks em http://{args.host}:{args.porta}/webhooks/<conta>")
+        servidor.serve_forever()
+        return 0
+
+    for r in replay(args.eventos, args.url, args.token, args.conta, EstadoLocal(args.estado)):
+        print(r)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,416 @@
+"""
+Modo workers: um coordenador distribui os deals em shards numa fila SQLite local
+e vários processos trabalhadores reivindicam, baixam e gravam os holerites.
+
+    python workers.py executar --contas cliente_a cliente_b --meses 1 --anos 2025 --workers 4
+    python workers.py trabalhar --execucao 3 --shard 0      # um worker avulso
+
+Pela linha de comando, as contas vêm do rd_contas.json; a conta principal do app
+(credenciais no main.py) só roda pelo painel "Modo workers" do app.
+
+Cada item é reivindicado com lease: se o worker morrer, o item volta para a
+fila quando o lease expira. A conclusão só vale para quem ainda detém o lease.
+Os workers recebem as contas sem credenciais: só o coordenador renova tokens,
+e a taxa de requisições de cada conta é um token bucket compartilhado na fila.
+"""
+import argparse
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+from contas import Conta, LimitadorTaxaCompartilhado, carregar_contas
+from deduplicacao import chave_arquivo
+
+FILA_DB = "fila_holerites.db"
+SAIDA_DIR = "holerites_saida"
+
+LEASE_SEGUNDOS = 300
+MAX_TENTATIVAS = 3
+ESPERA_FILA_VAZIA = 1.0
+# Com que frequência o coordenador confere (e renova) os tokens enquanto os workers rodam
+INTERVALO_TOKENS = 60
+
+
+def shard_do_deal(deal_id, n_shards) -> int:
+    return int(hashlib.sha1(str(deal_id).encode()).hexdigest()[:8], 16) % max(1, n_shards)
+
+
+class FilaDeals:
+    """Fila durável de deals em SQLite (WAL), com reivindicação atômica e lease."""
+
+    def __init__(self, caminho=FILA_DB):
+        self.caminho = caminho
+        with self._conectar() as con:
+            con.executescript("""
+                CREATE TABLE IF NOT EXISTS execucoes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    parametros TEXT NOT NULL,
+                    contas TEXT NOT NULL,
+                    n_shards INTEGER NOT NULL,
+                    listagem_concluida INTEGER NOT NULL DEFAULT 0,
+                    criada_em REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS itens (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    execucao_id INTEGER NOT NULL,
+                    conta TEXT NOT NULL,
+                    deal_id TEXT NOT NULL,
+                    shard INTEGER NOT NULL,
+                    estado TEXT NOT NULL DEFAULT 'pendente',
+                    worker TEXT,
+                    lease_ate REAL,
+                    tentativas INTEGER NOT NULL DEFAULT 0,
+                    erro TEXT,
+                    UNIQUE (execucao_id, conta, deal_id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_itens_estado ON itens (execucao_id, estado, shard);
+                CREATE TABLE IF NOT EXISTS arquivos (
+                    execucao_id INTEGER NOT NULL,
+                    conta TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    deal_id TEXT NOT NULL,
+                    nome TEXT NOT NULL,
+                    caminho TEXT NOT NULL,
+                    tamanho INTEGER NOT NULL,
+                    UNIQUE (execucao_id, conta, sha256)
+                );
+            """)
+            # Execuções antigas gravavam as credenciais das contas — remove
+            for row in con.execute("SELECT id, contas FROM execucoes WHERE contas LIKE '%client_secret%'").fetchall():
+                contas = [{k: v for k, v in c.items() if k not in ('client_id', 'client_secret')}
+                          for c in json.loads(row['contas'])]
+                con.execute("UPDATE execucoes SET contas = ? WHERE id = ?", (json.dumps(contas), row['id']))
+
+    def _conectar(self):
+        con = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.row_factory = sqlite3.Row
+        return con
+
+    def nova_execucao(self, contas, meses=None, anos=None, n_shards=1, hedge=False):
+        with self._conectar() as con:
+            cur = con.execute(
+                "INSERT INTO execucoes (parametros, contas, n_shards, criada_em) VALUES (?, ?, ?, ?)",
+                (json.dumps({'meses': meses or [], 'anos': anos or [], 'hedge': hedge}),
+                 json.dumps([c.config() for c in contas]), n_shards, time.time())
+            )
+            return cur.lastrowid
+
+    def execucao(self, execucao_id):
+        with self._conectar() as con:
+            row = con.execute("SELECT * FROM execucoes WHERE id = ?", (execucao_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row['id'],
+            'parametros': json.loads(row['parametros']),
+            'contas': json.loads(row['contas']),
+            'n_shards': row['n_shards'],
+            'listagem_concluida': bool(row['listagem_concluida']),
+        }
+
+    def enfileirar(self, execucao_id, conta, deal_ids, n_shards):
+        with self._conectar() as con:
+            con.executemany(
+                "INSERT OR IGNORE INTO itens (execucao_id, conta, deal_id, shard) VALUES (?, ?, ?, ?)",
+                [(execucao_id, conta, str(d), shard_do_deal(d, n_shards)) for d in deal_ids]
+            )
+
+    def concluir_listagem(self, execucao_id):
+        with self._conectar() as con:
+            con.execute("UPDATE execucoes SET listagem_concluida = 1 WHERE id = ?", (execucao_id,))
+
+    def reivindicar(self, execucao_id, worker_id, shard=None):
+        """Reivindica um item (do próprio shard primeiro, depois de qualquer um). None se não houver."""
+        agora = time.time()
+        con = self._conectar()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            # Leases expirados que já esgotaram as tentativas viram falha
+            con.execute(
+                "UPDATE itens SET estado = 'falhou', erro = COALESCE(erro, 'lease expirado') "
+                "WHERE execucao_id = ? AND estado = 'em_andamento' AND lease_ate < ? AND tentativas >= ?",
+                (execucao_id, agora, MAX_TENTATIVAS)
+            )
+            row = con.execute(
+                "SELECT * FROM itens WHERE execucao_id = ? AND "
+                "(estado = 'pendente' OR (estado = 'em_andamento' AND lease_ate < ?)) "
+                "ORDER BY (shard = ?) DESC, id LIMIT 1",
+                (execucao_id, agora, shard if shard is not None else -1)
+            ).fetchone()
+            if row is None:
+                con.execute("COMMIT")
+                return None
+            con.execute(
+                "UPDATE itens SET estado = 'em_andamento', worker = ?, lease_ate = ?, tentativas = tentativas + 1 "
+                "WHERE id = ?",
+                (worker_id, agora + LEASE_SEGUNDOS, row['id'])
+            )
+            con.execute("COMMIT")
+            return dict(row)
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+
+    def renovar_lease(self, item_id, worker_id) -> bool:
+        with self._conectar() as con:
+            cur = con.execute(
+                "UPDATE itens SET lease_ate = ? WHERE id = ? AND worker = ? AND estado = 'em_andamento'",
+                (time.time() + LEASE_SEGUNDOS, item_id, worker_id)
+            )
+            return cur.rowcount == 1
+
+    def concluir(self, item_id, worker_id) -> bool:
+        """Marca como concluído só se o worker ainda detém o item."""
+        with self._conectar() as con:
+            cur = con.execute(
+                "UPDATE itens SET estado = 'concluido', lease_ate = NULL "
+                "WHERE id = ? AND worker = ? AND estado = 'em_andamento'",
+                (item_id, worker_id)
+            )
+            return cur.rowcount == 1
+
+    def falhar(self, item_id, worker_id, erro):
+        """Devolve o item para a fila ou marca falha definitiva após MAX_TENTATIVAS."""
+        with self._conectar() as con:
+            con.execute(
+                "UPDATE itens SET estado = CASE WHEN tentativas >= ? THEN 'falhou' ELSE 'pendente' END, "
+                "erro = ?, lease_ate = NULL "
+                "WHERE id = ? AND worker = ? AND estado = 'em_andamento'",
+                (MAX_TENTATIVAS, str(erro)[:500], item_id, worker_id)
+            )
+
+    def registrar_arquivo(self, execucao_id, conta, h, caminho) -> bool:
+        """Registra o arquivo; False se o mesmo conteúdo (sha256) já foi gravado por outro item."""
+        with self._conectar() as con:
+            cur = con.execute(
+                "INSERT OR IGNORE INTO arquivos (execucao_id, conta, sha256, deal_id, nome, caminho, tamanho) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (execucao_id, conta, h['sha256'], str(h['deal_id']), h['nome'], caminho, h['tamanho'])
+            )
+            if cur.rowcount == 1:
+                return True
+            row = con.execute(
+                "SELECT caminho FROM arquivos WHERE execucao_id = ? AND conta = ? AND sha256 = ?",
+                (execucao_id, conta, h['sha256'])
+            ).fetchone()
+            # Reprocessamento do mesmo item (ex.: worker caiu) não é duplicado
+            return row is not None and row['caminho'] == caminho
+
+    def resumo(self, execucao_id):
+        with self._conectar() as con:
+            rows = con.execute(
+                "SELECT conta, estado, COUNT(*) AS n FROM itens WHERE execucao_id = ? GROUP BY conta, estado",
+                (execucao_id,)
+            ).fetchall()
+        resumo = {}
+        for r in rows:
+            resumo.setdefault(r['conta'], {})[r['estado']] = r['n']
+        return resumo
+
+    def terminou(self, execucao_id) -> bool:
+        execucao = self.execucao(execucao_id)
+        if not execucao or not execucao['listagem_concluida']:
+            return False
+        with self._conectar() as con:
+            row = con.execute(
+                "SELECT COUNT(*) AS n FROM itens WHERE execucao_id = ? AND estado IN ('pendente', 'em_andamento')",
+                (execucao_id,)
+            ).fetchone()
+        return row['n'] == 0
+
+    def arquivos(self, execucao_id):
+        with self._conectar() as con:
+            rows = con.execute(
+                "SELECT * FROM arquivos WHERE execucao_id = ? ORDER BY conta, deal_id, nome", (execucao_id,)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+
+def com_taxa_compartilhada(fila, conta):
+    """A conta passando pelo token bucket da fila — coordenador e workers dividem a mesma taxa."""
+    return conta.com_limitador(
+        LimitadorTaxaCompartilhado(fila.caminho, conta.nome, conta.limitador.taxa, conta.limitador.rajada)
+    )
+
+
+def coordenar(fila, execucao_id, contas, max_paginas=100, max_deals=100, processos=None):
+    """
+    Lista os deals de cada conta e os distribui em shards na fila. Com `processos`,
+    segue renovando os tokens das contas até os workers terminarem.
+    """
+    execucao = fila.execucao(execucao_id)
+    meses = execucao['parametros']['meses']
+    anos = execucao['parametros']['anos']
+    contas = [com_taxa_compartilhada(fila, c) for c in contas]
+    try:
+        for conta in contas:
+            lote = []
+            for deal in conta.listar_deals(meses, anos, ignorar_processados=bool(meses or anos),
+                                           max_paginas=max_paginas, max_deals=max_deals):
+                lote.append(deal.get('id'))
+                if len(lote) >= 100:
+                    fila.enfileirar(execucao_id, conta.nome, lote, execucao['n_shards'])
+                    lote = []
+            if lote:
+                fila.enfileirar(execucao_id, conta.nome, lote, execucao['n_shards'])
+    finally:
+        fila.concluir_listagem(execucao_id)
+
+    ultima_renovacao = time.monotonic()
+    while processos and any(p.poll() is None for p in processos) and not fila.terminou(execucao_id):
+        if time.monotonic() - ultima_renovacao >= INTERVALO_TOKENS:
+            for conta in contas:
+                conta.tokens.access_token()
+            ultima_renovacao = time.monotonic()
+        time.sleep(ESPERA_FILA_VAZIA)
+
+
+def marcar_processados(fila, execucao_id, contas):
+    """Sem filtro de data, marca como processados os deals que renderam arquivos (como no app)."""
+    parametros = fila.execucao(execucao_id)['parametros']
+    if parametros['meses'] or parametros['anos']:
+        return
+    por_conta = {}
+    for a in fila.arquivos(execucao_id):
+        por_conta.setdefault(a['conta'], set()).add(a['deal_id'])
+    for conta in contas:
+        if por_conta.get(conta.nome):
+            conta.salvar_processados(conta.carregar_processados() | por_conta[conta.nome])
+
+
+class LeasePerdido(Exception):
+    """Outro worker assumiu o item (lease expirou)."""
+
+
+def _manter_lease(fila, item_id, worker_id, parar, perdido):
+    """Heartbeat: renova o lease enquanto o deal baixa; sinaliza `perdido` se outro worker assumiu."""
+    while not parar.wait(LEASE_SEGUNDOS / 3):
+        if not fila.renovar_lease(item_id, worker_id):
+            perdido.set()
+            return
+
+
+def trabalhar(fila, execucao_id, shard=None, worker_id=None):
+    """Loop de um worker: reivindica, baixa, grava em disco e conclui até a fila esvaziar."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    execucao = fila.execucao(execucao_id)
+    contas = {cfg['nome']: com_taxa_compartilhada(fila, Conta(**cfg)) for cfg in execucao['contas']}
+    parametros = execucao['parametros']
+    processados = 0
+
+    while True:
+        item = fila.reivindicar(execucao_id, worker_id, shard)
+        if item is None:
+            if fila.terminou(execucao_id):
+                return processados
+            time.sleep(ESPERA_FILA_VAZIA)
+            continue
+
+        conta = contas[item['conta']]
+        parar, perdido = threading.Event(), threading.Event()
+        threading.Thread(
+            target=_manter_lease, args=(fila, item['id'], worker_id, parar, perdido), daemon=True
+        ).start()
+
+        def verificar_lease():
+            if perdido.is_set():
+                raise LeasePerdido()
+
+        try:
+            erros = []
+            holerites = conta.baixar_holerites_deal(
+                item['deal_id'], parametros['meses'], parametros['anos'], hedge=parametros['hedge'],
+                erros=erros, antes_do_arquivo=verificar_lease,
+            )
+            if perdido.is_set() or not fila.renovar_lease(item['id'], worker_id):
+                continue  # perdeu o lease: outro worker assumiu o item
+            pasta = os.path.join(SAIDA_DIR, str(execucao_id), conta.nome)
+            os.makedirs(pasta, exist_ok=True)
+            for h in holerites:
+                # sha no nome: dois arquivos homônimos no mesmo deal não se sobrescrevem
+                caminho = os.path.join(pasta, f"{h['sha256'][:12]}_{chave_arquivo(h['deal_id'], h['nome'])}")
+                with open(caminho, 'wb') as f:
+                    f.write(h['conteudo'])
+                if not fila.registrar_arquivo(execucao_id, conta.nome, h, caminho):
+                    os.remove(caminho)
+            if erros:
+                # Os arquivos que vieram ficam gravados; o item volta para a fila pelos que faltaram
+                fila.falhar(item['id'], worker_id, "; ".join(erros))
+                continue
+            fila.concluir(item['id'], worker_id)
+            processados += 1
+        except LeasePerdido:
+            continue
+        except Exception as e:
+            fila.falhar(item['id'], worker_id, e)
+        finally:
+            parar.set()
+
+
+def iniciar_workers(execucao_id, n_workers, caminho_fila=FILA_DB):
+    """Sobe `n_workers` processos `workers.py trabalhar`, um por shard."""
+    script = os.path.abspath(__file__)
+    return [
+        subprocess.Popen([
+            sys.executable, script, "trabalhar",
+            "--fila", caminho_fila, "--execucao", str(execucao_id), "--shard", str(shard)
+        ])
+        for shard in range(n_workers)
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download de holerites em múltiplos processos")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_exec = sub.add_parser("executar", help="coordena e sobe os workers")
+    p_exec.add_argument("--contas", nargs="+", required=True, help="nomes das contas em rd_contas.json")
+    p_exec.add_argument("--meses", nargs="*", type=int, default=[])
+    p_exec.add_argument("--anos", nargs="*", type=int, default=[])
+    p_exec.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    p_exec.add_argument("--hedge", action="store_true")
+    p_exec.add_argument("--fila", default=FILA_DB)
+
+    p_trab = sub.add_parser("trabalhar", help="roda um worker de uma execução existente")
+    p_trab.add_argument("--execucao", type=int, required=True)
+    p_trab.add_argument("--shard", type=int)
+    p_trab.add_argument("--fila", default=FILA_DB)
+
+    args = parser.parse_args(argv)
+    fila = FilaDeals(args.fila)
+
+    if args.comando == "trabalhar":
+        n = trabalhar(fila, args.execucao, args.shard)
+        print(f"worker {os.getpid()}: {n} deals processados")
+        return 0
+
+    contas_por_nome = {c.nome: c for c in carregar_contas()}
+    faltando = [n for n in args.contas if n not in contas_por_nome]
+    if faltando:
+        parser.error(f"contas não encontradas em rd_contas.json: {', '.join(faltando)} "
+                     "(a conta principal do app só roda pelo painel \"Modo workers\")")
+    contas = [contas_por_nome[n] for n in args.contas]
+
+    execucao_id = fila.nova_execucao(contas, args.meses, args.anos, n_shards=args.workers, hedge=args.hedge)
+    processos = iniciar_workers(execucao_id, args.workers, args.fila)
+    coordenar(fila, execucao_id, contas, processos=processos)
+    for p in processos:
+        p.wait()
+    marcar_processados(fila, execucao_id, contas)
+
+    print(f"execução {execucao_id}: {json.dumps(fila.resumo(execucao_id), ensure_ascii=False)}")
+    print(f"arquivos em {os.path.join(SAIDA_DIR, str(execucao_id))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())